@@ -1,16 +1,18 @@
 
 from flask import Flask, jsonify, render_template, request, session, redirect, url_for, flash, send_file
 try:
-    from flask_socketio import SocketIO, emit
+    from flask_socketio import SocketIO, emit, join_room, leave_room
     SOCKETIO_AVAILABLE = True
 except ImportError:
     print("⚠️  Flask-SocketIO not available. Real-time features will be disabled.")
     SOCKETIO_AVAILABLE = False
     SocketIO = None
     emit = None
+    join_room = None
+    leave_room = None
 import json
 import datetime
-from collections import defaultdict
+from collections import defaultdict, OrderedDict, deque
 import os
 import hashlib
 
@@ -21,6 +23,16 @@ import time
 
 # Database configuration
 EVENTS_DB_PATH = os.getenv("EVENTS_DB_PATH", "events.db")
+EVENTS_DB_POOL_SIZE = int(os.getenv("EVENTS_DB_POOL_SIZE", "16"))
+EVENTS_DB_CACHE_KB = int(os.getenv("EVENTS_DB_CACHE_KB", "32768"))  # page cache per connection
+EVENTS_DB_MMAP_BYTES = int(os.getenv("EVENTS_DB_MMAP_BYTES", str(256 * 1024 * 1024)))
+
+# Ingest writer configuration (group commit)
+INGEST_QUEUE_MAX = int(os.getenv("INGEST_QUEUE_MAX", "1000"))  # pending /ingest requests
+INGEST_COMMIT_INTERVAL_MS = int(os.getenv("INGEST_COMMIT_INTERVAL_MS", "50"))
+INGEST_COMMIT_MAX_EVENTS = int(os.getenv("INGEST_COMMIT_MAX_EVENTS", "5000"))
+INGEST_ACK_TIMEOUT = float(os.getenv("INGEST_ACK_TIMEOUT", "30"))  # seconds
+LOG_IMPORT_BATCH_SESSIONS = int(os.getenv("LOG_IMPORT_BATCH_SESSIONS", "20000"))  # sessions per import transaction
 
 # Ingest security configuration
 INGEST_KEY = os.getenv("INGEST_KEY", "")
@@ -36,6 +48,19 @@ except ImportError:
     print("⚠️  ReportLab not available. PDF export will be disabled.")
     REPORTLAB_AVAILABLE = False
 import io
+import sys
+import atexit
+import uuid
+import shutil
+import math
+import zlib
+import struct
+import heapq
+import mmap
+import bisect
+import re
+import queue
+import concurrent.futures
 import threading
 import time
 
@@ -58,13 +83,60 @@ USERS = {
 
 LOG_DIR = "logs"
 HISTORICAL_FILE = "historical_summary.json"
+# Index of the day files under LOG_DIR so log readers never walk the tree
+LOG_MANIFEST_PATH = os.getenv("LOG_MANIFEST_PATH", os.path.join(LOG_DIR, "manifest.db"))
+
+# A Pi is live while its last heartbeat (or GPS/ingest/upload) is at most this old
+PI_LIVE_TIMEOUT = float(os.getenv("PI_LIVE_TIMEOUT", "15"))  # seconds
+
+# Bumped whenever new passenger or GPS data is stored; drives the ETags of polled endpoints.
+# The process start time keeps validators from a previous run from matching after a restart.
+data_version = 0
+_data_version_lock = threading.Lock()
+_data_version_epoch = f"{int(time.time()):x}"
+
+# (endpoint, args) -> (etag, body, mimetype), least recently used first
+_response_cache = OrderedDict()
+_response_cache_lock = threading.Lock()
+RESPONSE_CACHE_MAX_ENTRIES = 512
+
+# Dashboard push: sid -> counts room, plus the (toda_id, etrike_id) pairs
+# touched by ingests since the last push
+DASHBOARD_PUSH_INTERVAL = float(os.getenv("DASHBOARD_PUSH_INTERVAL", "1.0"))  # seconds
+_dashboard_rooms = {}
+_dashboard_pending = set()
+_dashboard_push_timer = None
+_dashboard_push_lock = threading.Lock()
+_dashboard_last_pushed = {}
+_dashboard_clock_thread = None
+
+# Latest GPS fixes live in memory (gps_store) and are snapshotted to disk in the background
+GPS_HISTORY_PER_VEHICLE = int(os.getenv("GPS_HISTORY_PER_VEHICLE", "100"))  # recent fixes kept per pi_id
+GPS_SNAPSHOT_PATH = os.getenv("GPS_SNAPSHOT_PATH", os.path.join(LOG_DIR, "gps_snapshot.json"))
+GPS_SNAPSHOT_INTERVAL = float(os.getenv("GPS_SNAPSHOT_INTERVAL", "10"))  # seconds
+GPS_BATCH_MAX_FIXES = int(os.getenv("GPS_BATCH_MAX_FIXES", "5000"))  # fixes accepted per /gps-data request
+
+# Motion state per vehicle: moving -> idle -> parked, or offline when fixes stop
+GPS_MOVE_THRESHOLD_M = float(os.getenv("GPS_MOVE_THRESHOLD_M", "25"))  # distance from anchor that counts as moving
+GPS_IDLE_AFTER = float(os.getenv("GPS_IDLE_AFTER", "60"))  # seconds within the threshold before idle
+GPS_PARK_AFTER = float(os.getenv("GPS_PARK_AFTER", "600"))  # seconds within the threshold before parked
+GPS_OFFLINE_AFTER = float(os.getenv("GPS_OFFLINE_AFTER", "300"))  # seconds without a fix before offline
 
-# Global variable to track when Pi devices last sent heartbeat
-last_pi_heartbeat_time = 0
+# Full tracks: one append-only binary file per device per day under GPS_TRACK_DIR
+GPS_TRACK_DIR = os.getenv("GPS_TRACK_DIR", os.path.join(LOG_DIR, "tracks"))
+GPS_TRACK_MAX_DAYS = int(os.getenv("GPS_TRACK_MAX_DAYS", "7"))  # longest range /vehicle-track serves
+GPS_TRACK_TOLERANCE_PX = float(os.getenv("GPS_TRACK_TOLERANCE_PX", "1.5"))  # simplification tolerance in screen pixels
+GPS_TRACK_QUEUE_MAX = int(os.getenv("GPS_TRACK_QUEUE_MAX", "10000"))  # pending batches for the track writer
+GPS_CLOCK_SKEW_TOLERANCE = float(os.getenv("GPS_CLOCK_SKEW_TOLERANCE", "120"))  # seconds a Pi clock may disagree with ours
 
-# Global variable to control the background thread
-gps_broadcast_thread = None
-stop_broadcast = False
+# Uniform grid over latest positions for bbox queries; /vehicle-locations clusters at or below GPS_CLUSTER_MAX_ZOOM
+GPS_GRID_CELL_DEG = float(os.getenv("GPS_GRID_CELL_DEG", "0.01"))  # ~1.1 km
+GPS_CLUSTER_MAX_ZOOM = int(os.getenv("GPS_CLUSTER_MAX_ZOOM", "13"))
+GPS_CLUSTER_CELL_PX = int(os.getenv("GPS_CLUSTER_CELL_PX", "80"))  # on-screen size of a cluster cell
+
+# GPS broadcaster: parks with no map subscribers, ticks when fixes arrive (at most every GPS_TICK_MIN)
+GPS_TICK_MIN = float(os.getenv("GPS_TICK_MIN", "0.5"))  # seconds
+GPS_TICK_MAX = float(os.getenv("GPS_TICK_MAX", "5"))  # seconds between ticks without fixes (status expiry)
 
 def format_trip_duration(minutes):
     """Format trip duration from minutes to readable format (hours, minutes, seconds)"""
@@ -83,14 +155,414 @@ def format_trip_duration(minutes):
     else:
         return f"{secs}s"
 
-def get_latest_log_time():
-    """Finds the timestamp of the most recent log entry."""
-    latest_time = None
-    latest_timestamp = 0
+# ============================================================================
+# LOG FILES - append-only NDJSON (one record per line), legacy JSON arrays still read
+# ============================================================================
 
-    if not os.path.exists(LOG_DIR):
-        return datetime.datetime.now()
+UPLOAD_SPOOL_MAX_BYTES = int(os.getenv("UPLOAD_SPOOL_MAX_BYTES", str(8 * 1024 * 1024)))  # kept in memory before spilling to disk
+UPLOAD_BUFFER_ENTRIES = int(os.getenv("UPLOAD_BUFFER_ENTRIES", "20000"))  # parsed entries held before appending
+LOG_CACHE_MAX_BYTES = int(os.getenv("LOG_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))  # on-disk size of cached files
+
+# path -> (mtime_ns, size, entries), least recently used first
+_log_cache = OrderedDict()
+_log_cache_lock = threading.Lock()
+_log_cache_bytes = 0
+_log_cache_stats = {'hits': 0, 'misses': 0}
+
+# Month-wide log fallbacks fan file reads out over this pool
+LOG_SCAN_WORKERS = int(os.getenv("LOG_SCAN_WORKERS", str(min(32, (os.cpu_count() or 1) * 4))))
+LOG_SCAN_DEADLINE = float(os.getenv("LOG_SCAN_DEADLINE", "20"))  # seconds per request
+_log_scan_executor = concurrent.futures.ThreadPoolExecutor(max_workers=LOG_SCAN_WORKERS, thread_name_prefix="log-scan")
+
+_log_path_locks = {}
+_log_path_locks_guard = threading.Lock()
+
+def load_log_entries(f):
+    """Parse an open log file: NDJSON records, or a legacy JSON array/object"""
+    text = f.read()
+    stripped = text.lstrip()
+    if not stripped:
+        return []
+    if stripped[0] == '[':
+        return json.loads(text)
+    entries = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            entries.append(json.loads(line))
+        except json.JSONDecodeError:
+            if not entries and stripped[0] == '{' and line == '{':
+                # Legacy pretty-printed single object
+                data = json.loads(text)
+                return [data] if isinstance(data, dict) else data
+            # Torn record from an interrupted append; later lines are still whole
+            print(f"⚠️  Ignoring truncated record in {getattr(f, 'name', 'log file')}")
+    return entries
+
+def iter_json_records(stream, chunk_size=64 * 1024):
+    """Yield records from a binary stream holding a JSON array, a single object or NDJSON,
+    without reading the whole stream into memory"""
+    decoder = json.JSONDecoder()
+    reader = io.TextIOWrapper(stream, encoding='utf-8')
+    buf, pos, eof = '', 0, False
+    in_array = None
+    while True:
+        # Skip whitespace and separators, reading more as needed
+        while True:
+            while pos < len(buf) and buf[pos] in ' \t\r\n,':
+                pos += 1
+            if pos < len(buf) or eof:
+                break
+            chunk = reader.read(chunk_size)
+            buf, pos, eof = chunk, 0, not chunk
+        if pos >= len(buf):
+            return
+        if in_array is None:
+            in_array = buf[pos] == '['
+            if in_array:
+                pos += 1
+                continue
+        if in_array and buf[pos] == ']':
+            return
+        try:
+            record, pos = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            # Record cut by the chunk boundary
+            chunk = reader.read(chunk_size)
+            buf, pos, eof = buf[pos:] + chunk, 0, not chunk
+            continue
+        yield record
+
+def read_log_file(path):
+    """Entries of a log file in either format; [] if it does not exist.
+
+    Parsed files are cached by (path, mtime_ns, size), so unchanged days are
+    never read from disk twice.
+    """
+    global _log_cache_bytes
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return []
+    
+    with _log_cache_lock:
+        cached = _log_cache.get(path)
+        if cached and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+            _log_cache.move_to_end(path)
+            _log_cache_stats['hits'] += 1
+            return list(cached[2])
+        _log_cache_stats['misses'] += 1
+    
+    try:
+        with open(path, 'r') as f:
+            entries = load_log_entries(f)
+        # Key on the stat taken after reading so a concurrent append is never cached as current
+        st_after = os.stat(path)
+    except FileNotFoundError:
+        return []
+    
+    with _log_cache_lock:
+        previous = _log_cache.pop(path, None)
+        if previous:
+            _log_cache_bytes -= previous[1]
+        if st_after.st_mtime_ns == st.st_mtime_ns and st_after.st_size == st.st_size \
+                and st.st_size <= LOG_CACHE_MAX_BYTES:
+            _log_cache[path] = (st.st_mtime_ns, st.st_size, entries)
+            _log_cache_bytes += st.st_size
+            while _log_cache_bytes > LOG_CACHE_MAX_BYTES:
+                _, (_, size, _) = _log_cache.popitem(last=False)
+                _log_cache_bytes -= size
+    return list(entries)
+
+def _scan_one_log_file(path):
+    """read_log_file for the scan pool; a corrupt file contributes no entries"""
+    try:
+        return read_log_file(path)
+    except (json.JSONDecodeError, OSError) as e:
+        print(f"⚠️  Skipping unreadable log file {path}: {e}")
+        return []
+
+def scan_log_files(paths, deadline_at=None):
+    """Read log files in parallel; returns one entry list per path, in the order given.
+
+    deadline_at is a time.monotonic() value shared by all scans of a request;
+    TimeoutError is raised if the files are not all read by then.
+    """
+    if not paths:
+        return []
+    if deadline_at is None:
+        deadline_at = time.monotonic() + LOG_SCAN_DEADLINE
+    futures = [_log_scan_executor.submit(_scan_one_log_file, path) for path in paths]
+    _, pending = concurrent.futures.wait(futures, timeout=max(0, deadline_at - time.monotonic()))
+    if pending:
+        for future in pending:
+            future.cancel()
+        raise TimeoutError(f"Log scan of {len(paths)} files exceeded the {LOG_SCAN_DEADLINE}s deadline")
+    return [future.result() for future in futures]
+
+def legacy_month_log_paths(month_start):
+    """Legacy day file paths (D.json) for every day of month_start's month"""
+    paths = []
+    current_day = month_start
+    while current_day.month == month_start.month and current_day.year == month_start.year:
+        paths.append(os.path.join(LOG_DIR, str(current_day.year), str(current_day.month), f"{current_day.day}.json"))
+        current_day += datetime.timedelta(days=1)
+    return paths
+
+def log_cache_stats():
+    """Hit/miss counters and footprint of the parsed log file cache"""
+    with _log_cache_lock:
+        return {
+            'hits': _log_cache_stats['hits'],
+            'misses': _log_cache_stats['misses'],
+            'files': len(_log_cache),
+            'bytes': _log_cache_bytes,
+            'max_bytes': LOG_CACHE_MAX_BYTES,
+        }
+
+def log_path_lock(path):
+    """Lock serialising appends and rewrites of one log file"""
+    key = os.path.normpath(path)
+    with _log_path_locks_guard:
+        lock = _log_path_locks.get(key)
+        if lock is None:
+            lock = _log_path_locks[key] = threading.Lock()
+        return lock
+
+def _is_ndjson(path):
+    """True if the file is empty or already holds one record per line"""
+    with open(path, 'rb') as f:
+        head = f.read(64).lstrip()
+    if not head:
+        return True
+    if head[:1] != b'{':
+        return False
+    with open(path, 'rb') as f:
+        first_line = f.readline()
+    try:
+        json.loads(first_line)
+        return True
+    except ValueError:
+        return False
+
+def write_log_file(path, entries):
+    """Atomically replace a log file with NDJSON records"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        for entry in entries:
+            f.write(json.dumps(entry) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def _log_entry_key(entry, kind):
+    """Dedup key of a record: upload signature or ingest event id"""
+    if kind == 'event_id':
+        return entry.get('event_id') or None
+    return f"{entry.get('person_id')}_{entry.get('entry_timestamp')}_{entry.get('pi_id')}"
+
+def append_log_entries(path, entries, key_kind='signature'):
+    """Append records not already in the file; returns (added, duplicates)"""
+    # Open the manifest first so a first-use rebuild cannot count this append twice
+    _log_manifest_conn().close()
+    with log_path_lock(path):
+        dir_path = os.path.dirname(path)
+        if dir_path:
+            os.makedirs(dir_path, exist_ok=True)
+        
+        exists = os.path.exists(path)
+        if exists and not _is_ndjson(path):
+            # One-off conversion of a legacy JSON array before the first append
+            write_log_file(path, read_log_file(path))
+        
+        conn = _log_manifest_conn()
+        try:
+            file_id = _signature_index_file(conn, path, key_kind)
+            
+            # Bulk lookup of the batch's keys in the persistent index
+            hashed = [_signature_hash(_log_entry_key(e, key_kind)) for e in entries]
+            seen = _indexed_signatures(conn, file_id, {h for h in hashed if h is not None})
+            added, added_keys = [], []
+            duplicates = 0
+            for entry, key in zip(entries, hashed):
+                if key is not None and key in seen:
+                    duplicates += 1
+                    continue
+                if key is not None:
+                    seen.add(key)
+                    added_keys.append(key)
+                added.append(entry)
+            
+            if added:
+                with open(path, 'ab+') as f:
+                    # Start on a fresh line if a previous append was cut short
+                    if f.tell() > 0:
+                        f.seek(-1, os.SEEK_END)
+                        if f.read(1) != b'\n':
+                            f.write(b'\n')
+                    f.write(''.join(json.dumps(e) + '\n' for e in added).encode('utf-8'))
+                st = os.stat(path)
+                conn.executemany("INSERT OR IGNORE INTO log_signatures VALUES (?, ?)",
+                                 [(file_id, key) for key in added_keys])
+                conn.execute("UPDATE log_signature_files SET size = ?, mtime_ns = ? WHERE file_id = ?",
+                             (st.st_size, st.st_mtime_ns, file_id))
+                conn.commit()
+        finally:
+            conn.close()
+        
+        if added:
+            _manifest_append(path, added)
+            if USE_INGEST and _logs_imported:
+                _import_appended_log_entries(path, added, st)
+        return len(added), duplicates
+
+def convert_logs_to_ndjson():
+    """Rewrite legacy JSON-array log files as NDJSON (python dashboard.py --convert-logs-ndjson)"""
+    conn = _log_manifest_conn()
+    try:
+        paths = [os.path.join(LOG_DIR, path) for (path,) in conn.execute("SELECT path FROM log_files ORDER BY path")]
+    finally:
+        conn.close()
+    
+    converted = 0
+    for path in paths:
+        try:
+            if not os.path.exists(path) or _is_ndjson(path):
+                continue
+            with log_path_lock(path):
+                entries = read_log_file(path)
+                write_log_file(path, entries)
+            update_log_manifest(path, entries)
+            converted += 1
+            print(f"[NDJSON] Converted {path} ({len(entries)} entries)")
+        except (json.JSONDecodeError, OSError) as e:
+            print(f"[NDJSON] Could not convert {path}: {e}")
+    print(f"[NDJSON] Converted {converted} log files")
+    return converted
+
+# ============================================================================
+# LOG MANIFEST - date, device, entry count and timestamp range of each log file
+# ============================================================================
+
+_log_manifest_lock = threading.Lock()
+_log_manifest_ready = False
+
+def _log_manifest_conn():
+    """Open the manifest database, building it from the log tree on first use"""
+    global _log_manifest_ready
+    with _log_manifest_lock:
+        if not _log_manifest_ready:
+            os.makedirs(os.path.dirname(LOG_MANIFEST_PATH) or '.', exist_ok=True)
+            is_new = not os.path.exists(LOG_MANIFEST_PATH)
+            conn = sqlite3.connect(LOG_MANIFEST_PATH, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS log_files (
+                    path TEXT PRIMARY KEY,
+                    year INTEGER NOT NULL,
+                    month INTEGER NOT NULL,
+                    day INTEGER NOT NULL,
+                    device_id TEXT,
+                    entries INTEGER NOT NULL,
+                    min_ts REAL,
+                    max_ts REAL,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_log_files_date ON log_files(year, month, day)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_log_files_max_ts ON log_files(max_ts)")
+            _create_signature_index(conn)
+            conn.commit()
+            _log_manifest_ready = True
+            if is_new:
+                _rebuild_log_manifest(conn)
+            return conn
+    return sqlite3.connect(LOG_MANIFEST_PATH, timeout=30, check_same_thread=False)
+
+def _parse_log_path(path):
+    """(relative path, year, month, day, device_id) for a day file under LOG_DIR, else None"""
+    rel = os.path.relpath(path, LOG_DIR)
+    parts = rel.split(os.sep)
+    if len(parts) != 3 or not parts[2].endswith('.json'):
+        return None
+    day_part, _, device_id = parts[2][:-len('.json')].partition('_')
+    try:
+        return rel, int(parts[0]), int(parts[1]), int(day_part), device_id or None
+    except ValueError:
+        return None
+
+def _manifest_row(path, entries):
+    """Manifest row for a log file given its parsed entries"""
+    parsed = _parse_log_path(path)
+    if parsed is None:
+        return None
+    if isinstance(entries, dict):
+        entries = [entries]
+    timestamps = [e.get('entry_timestamp') for e in entries
+                  if isinstance(e, dict) and isinstance(e.get('entry_timestamp'), (int, float))]
+    st = os.stat(path)
+    return parsed + (len(entries),
+                     min(timestamps) if timestamps else None,
+                     max(timestamps) if timestamps else None,
+                     st.st_size, st.st_mtime_ns)
 
+_MANIFEST_UPSERT_SQL = """
+    INSERT OR REPLACE INTO log_files
+        (path, year, month, day, device_id, entries, min_ts, max_ts, size, mtime_ns)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+def update_log_manifest(path, entries=None):
+    """Record a log file that was just written; entries are re-read when not given"""
+    try:
+        if entries is None:
+            entries = read_log_file(path)
+        row = _manifest_row(path, entries)
+        if row is None:
+            return
+        conn = _log_manifest_conn()
+        try:
+            conn.execute(_MANIFEST_UPSERT_SQL, row)
+            conn.commit()
+        finally:
+            conn.close()
+    except Exception as e:
+        print(f"[MANIFEST] Could not index {path}: {e}")
+
+def _manifest_append(path, new_entries):
+    """Fold entries just appended to a log file into its manifest row"""
+    try:
+        row = _manifest_row(path, new_entries)
+        if row is None:
+            return
+        conn = _log_manifest_conn()
+        try:
+            conn.execute("""
+                INSERT INTO log_files
+                    (path, year, month, day, device_id, entries, min_ts, max_ts, size, mtime_ns)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(path) DO UPDATE SET
+                    entries = entries + excluded.entries,
+                    min_ts = MIN(COALESCE(min_ts, excluded.min_ts), COALESCE(excluded.min_ts, min_ts)),
+                    max_ts = MAX(COALESCE(max_ts, excluded.max_ts), COALESCE(excluded.max_ts, max_ts)),
+                    size = excluded.size,
+                    mtime_ns = excluded.mtime_ns
+            """, row)
+            conn.commit()
+        finally:
+            conn.close()
+    except Exception as e:
+        print(f"[MANIFEST] Could not index {path}: {e}")
+
+def _walk_log_tree():
+    """Paths of every day file under LOG_DIR"""
+    if not os.path.exists(LOG_DIR):
+        return
     for year_dir in os.listdir(LOG_DIR):
         year_path = os.path.join(LOG_DIR, year_dir)
         if not os.path.isdir(year_path): continue
@@ -98,24 +570,210 @@ def get_latest_log_time():
             month_path = os.path.join(year_path, month_dir)
             if not os.path.isdir(month_path): continue
             for day_file in os.listdir(month_path):
-                if day_file.endswith('.json'):
-                    try:
-                        day_date = datetime.datetime(int(year_dir), int(month_dir), int(day_file.split('.')[0]))
-                        if latest_time is None or day_date.date() > latest_time.date():
-                            log_path = os.path.join(month_path, day_file)
-                            with open(log_path, 'r') as f:
-                                log_data = json.load(f)
-                                if not log_data: continue
-                                # Find the max timestamp in the latest day's file
-                                file_max_ts = max(entry.get('entry_timestamp', 0) for entry in log_data)
-                                if file_max_ts > latest_timestamp:
-                                    latest_timestamp = file_max_ts
-                                    latest_time = day_date
-
-                    except (ValueError, json.JSONDecodeError):
-                        continue
+                path = os.path.join(month_path, day_file)
+                if _parse_log_path(path) is not None:
+                    yield path
+
+def _scan_manifest_row(path):
+    """Manifest row for a log file read from disk, or None if it cannot be parsed"""
+    try:
+        with open(path, 'r') as f:
+            return _manifest_row(path, load_log_entries(f))
+    except (json.JSONDecodeError, OSError) as e:
+        print(f"[MANIFEST] Skipping {path}: {e}")
+        return None
+
+def _rebuild_log_manifest(conn):
+    """Replace the manifest with a fresh scan of LOG_DIR"""
+    print("[MANIFEST] Rebuilding log manifest...")
+    rows = [row for row in map(_scan_manifest_row, _walk_log_tree()) if row]
+    conn.execute("DELETE FROM log_files")
+    conn.executemany(_MANIFEST_UPSERT_SQL, rows)
+    conn.commit()
+    print(f"[MANIFEST] Indexed {len(rows)} log files")
+    return len(rows)
+
+def rebuild_log_manifest():
+    """Recovery command: rescan the log tree (python dashboard.py --rebuild-log-manifest)"""
+    conn = _log_manifest_conn()
+    try:
+        return _rebuild_log_manifest(conn)
+    finally:
+        conn.close()
+
+def reconcile_log_manifest():
+    """Bring the manifest in line with the log tree.
+
+    Files written outside the app (copied in, restored from backup, edited by
+    hand) never reach update_log_manifest. Only files whose size/mtime differ
+    from their row are re-read; rows for vanished files are dropped.
+    Returns (added_or_updated, removed).
+    """
+    conn = _log_manifest_conn()
+    try:
+        known = {path: (size, mtime_ns) for path, size, mtime_ns in
+                 conn.execute("SELECT path, size, mtime_ns FROM log_files")}
+        rows, seen = [], set()
+        for path in _walk_log_tree():
+            rel = os.path.relpath(path, LOG_DIR)
+            seen.add(rel)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if known.get(rel) == (st.st_size, st.st_mtime_ns):
+                continue
+            row = _scan_manifest_row(path)
+            if row:
+                rows.append(row)
+        removed = [(path,) for path in known if path not in seen]
+        conn.executemany(_MANIFEST_UPSERT_SQL, rows)
+        conn.executemany("DELETE FROM log_files WHERE path = ?", removed)
+        conn.commit()
+    finally:
+        conn.close()
+    if rows or removed:
+        print(f"[MANIFEST] Reconciled log manifest: {len(rows)} files indexed, {len(removed)} removed")
+    return len(rows), len(removed)
+
+# ============================================================================
+# SIGNATURE INDEX - persistent dedup keys of every log file
+# ============================================================================
+
+def _create_signature_index(conn):
+    """Signature tables in the manifest database.
+
+    Keys are 64-bit hashes of the upload signature or ingest event_id, stored
+    per (file, kind) in a WITHOUT ROWID table whose primary key is the lookup.
+    size/mtime_ns record the file state the keys were last synced with.
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS log_signature_files (
+            file_id INTEGER PRIMARY KEY,
+            path TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            UNIQUE (path, kind)
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS log_signatures (
+            file_id INTEGER NOT NULL,
+            key INTEGER NOT NULL,
+            PRIMARY KEY (file_id, key)
+        ) WITHOUT ROWID
+    """)
+    # Files already deduplicated by cleanup_duplicate_data, as of size/mtime_ns
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS log_cleanup_state (
+            path TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL
+        )
+    """)
+    # Background cleanup jobs; a job still 'running' at startup is resumed
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS cleanup_jobs (
+            job_id TEXT PRIMARY KEY,
+            state TEXT NOT NULL,
+            files_total INTEGER NOT NULL DEFAULT 0,
+            files_done INTEGER NOT NULL DEFAULT 0,
+            duplicates_removed INTEGER NOT NULL DEFAULT 0,
+            created_at REAL NOT NULL,
+            started_at REAL,
+            finished_at REAL,
+            error TEXT
+        )
+    """)
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(cleanup_jobs)")}
+    if 'malformed_entries' not in columns:
+        conn.execute("ALTER TABLE cleanup_jobs ADD COLUMN malformed_entries INTEGER NOT NULL DEFAULT 0")
+
+def _signature_hash(key):
+    """Signed 64-bit hash of a dedup key (None stays None)"""
+    if key is None:
+        return None
+    return int.from_bytes(hashlib.blake2b(str(key).encode('utf-8'), digest_size=8).digest(), 'big', signed=True)
+
+def _signature_index_file(conn, path, kind):
+    """file_id of a log file's key set, re-indexing the file if it changed behind our back"""
+    rel = os.path.relpath(path, LOG_DIR)
+    try:
+        st = os.stat(path)
+        size, mtime_ns = st.st_size, st.st_mtime_ns
+    except FileNotFoundError:
+        size, mtime_ns = 0, 0
+    row = conn.execute("SELECT file_id, size, mtime_ns FROM log_signature_files WHERE path = ? AND kind = ?",
+                       (rel, kind)).fetchone()
+    if row and (row[1], row[2]) == (size, mtime_ns):
+        return row[0]
+    
+    if row:
+        file_id = row[0]
+        conn.execute("DELETE FROM log_signatures WHERE file_id = ?", (file_id,))
+        conn.execute("UPDATE log_signature_files SET size = ?, mtime_ns = ? WHERE file_id = ?",
+                     (size, mtime_ns, file_id))
+    else:
+        file_id = conn.execute("INSERT INTO log_signature_files (path, kind, size, mtime_ns) VALUES (?, ?, ?, ?)",
+                               (rel, kind, size, mtime_ns)).lastrowid
+    if size:
+        keys = {_signature_hash(_log_entry_key(e, kind)) for e in read_log_file(path) if isinstance(e, dict)}
+        keys.discard(None)
+        conn.executemany("INSERT OR IGNORE INTO log_signatures VALUES (?, ?)", [(file_id, key) for key in keys])
+    conn.commit()
+    return file_id
+
+def _indexed_signatures(conn, file_id, keys):
+    """The subset of keys already indexed for a file"""
+    found = set()
+    keys = list(keys)
+    # Stay well below SQLite's bound-parameter limit
+    for i in range(0, len(keys), 500):
+        chunk = keys[i:i + 500]
+        placeholders = ",".join("?" * len(chunk))
+        rows = conn.execute(f"SELECT key FROM log_signatures WHERE file_id = ? AND key IN ({placeholders})",
+                            [file_id] + chunk)
+        found.update(row[0] for row in rows)
+    return found
+
+def _drop_signature_index(conn, path):
+    """Forget a rewritten file's keys; they are rebuilt on its next append"""
+    rel = os.path.relpath(path, LOG_DIR)
+    for (file_id,) in conn.execute("SELECT file_id FROM log_signature_files WHERE path = ?", (rel,)).fetchall():
+        conn.execute("DELETE FROM log_signatures WHERE file_id = ?", (file_id,))
+        conn.execute("DELETE FROM log_signature_files WHERE file_id = ?", (file_id,))
+
+def manifest_log_files(year, month, day=None):
+    """Paths of the log files for a day (or a whole month), from the manifest"""
+    conn = _log_manifest_conn()
+    try:
+        if day is None:
+            rows = conn.execute(
+                "SELECT path FROM log_files WHERE year = ? AND month = ? ORDER BY day, path",
+                (int(year), int(month))
+            ).fetchall()
+        else:
+            rows = conn.execute(
+                "SELECT path FROM log_files WHERE year = ? AND month = ? AND day = ? ORDER BY path",
+                (int(year), int(month), int(day))
+            ).fetchall()
+    finally:
+        conn.close()
+    return [os.path.join(LOG_DIR, path) for (path,) in rows]
+
+def get_latest_log_time():
+    """Finds the timestamp of the most recent log entry."""
+    if not os.path.exists(LOG_DIR):
+        return datetime.datetime.now()
+
+    conn = _log_manifest_conn()
+    try:
+        latest_timestamp = conn.execute("SELECT MAX(max_ts) FROM log_files").fetchone()[0]
+    finally:
+        conn.close()
     
-    if latest_timestamp > 0:
+    if latest_timestamp:
         # Convert timestamp to local time
         return datetime.datetime.fromtimestamp(latest_timestamp)
     
@@ -150,13 +808,8 @@ def update_historical_summary():
                     start_of_day = datetime.datetime.combine(check_date, datetime.time.min).timestamp()
                     end_of_day = datetime.datetime.combine(check_date, datetime.time.max).timestamp()
                     
-                    # Count unique completed sessions for this day
-                    daily_total = conn.execute("""
-                        SELECT COUNT(DISTINCT session_id) 
-                        FROM sessions 
-                        WHERE entry_timestamp >= ? AND entry_timestamp <= ?
-                        AND exit_timestamp IS NOT NULL
-                    """, (start_of_day, end_of_day)).fetchone()[0]
+                    # Count completed sessions for this day
+                    daily_total = _rollup_completed_sessions(conn, start_of_day, end_of_day)
                     
                     if daily_total > 0:
                         daily_data.append({
@@ -170,25 +823,24 @@ def update_historical_summary():
             pass
     
     # Fallback to log files if sessions not available or failed
-    if not daily_data:
+    if not daily_data and log_fallback_needed():
         for i in range(7):
             check_date = today.date() - datetime.timedelta(days=i)
             log_path = os.path.join(LOG_DIR, str(check_date.year), str(check_date.month), f"{check_date.day}.json")
             if os.path.exists(log_path):
                 try:
-                    with open(log_path, 'r') as log_file:
-                        log_data = json.load(log_file)
-                        daily_total = len(log_data)
-                        if daily_total > 0:
-                            daily_data.append({
-                                "date": check_date.strftime("%Y-%m-%d"),
-                                "total": daily_total
-                            })
+                    log_data = read_log_file(log_path)
+                    daily_total = len(log_data)
+                    if daily_total > 0:
+                        daily_data.append({
+                            "date": check_date.strftime("%Y-%m-%d"),
+                            "total": daily_total
+                        })
                 except (json.JSONDecodeError, FileNotFoundError):
                     continue
     
     # Get weekly data for the last 4 weeks (try sessions first)
-    if USE_INGEST and conn:
+    if USE_INGEST:
         try:
             conn = _events_db_conn()
             if conn:
@@ -198,12 +850,7 @@ def update_historical_summary():
                     start_epoch = datetime.datetime.combine(week_start, datetime.time.min).timestamp()
                     end_epoch = datetime.datetime.combine(week_end, datetime.time.max).timestamp()
                     
-                    weekly_total = conn.execute("""
-                        SELECT COUNT(DISTINCT session_id) 
-                        FROM sessions 
-                        WHERE entry_timestamp >= ? AND entry_timestamp <= ?
-                        AND exit_timestamp IS NOT NULL
-                    """, (start_epoch, end_epoch)).fetchone()[0]
+                    weekly_total = _rollup_completed_sessions(conn, start_epoch, end_epoch)
                     
                     if weekly_total > 0:
                         weekly_data.append({
@@ -215,7 +862,7 @@ def update_historical_summary():
             print(f"Error getting weekly data from sessions: {e}")
     
     # Fallback to log files for weekly data if sessions failed
-    if not weekly_data:
+    if not weekly_data and log_fallback_needed():
         for week_offset in range(4):
             week_start = today.date() - datetime.timedelta(days=today.weekday() + (week_offset * 7))
             weekly_total = 0
@@ -224,9 +871,8 @@ def update_historical_summary():
                 log_path = os.path.join(LOG_DIR, str(check_date.year), str(check_date.month), f"{check_date.day}.json")
                 if os.path.exists(log_path):
                     try:
-                        with open(log_path, 'r') as log_file:
-                            log_data = json.load(log_file)
-                            weekly_total += len(log_data)
+                        log_data = read_log_file(log_path)
+                        weekly_total += len(log_data)
                     except (json.JSONDecodeError, FileNotFoundError):
                         continue
             
@@ -265,12 +911,7 @@ def update_historical_summary():
                     start_epoch = month_start.timestamp()
                     end_epoch = datetime.datetime.combine(month_end, datetime.time.max).timestamp()
                     
-                    month_total = conn.execute("""
-                        SELECT COUNT(DISTINCT session_id) 
-                        FROM sessions 
-                        WHERE entry_timestamp >= ? AND entry_timestamp <= ?
-                        AND exit_timestamp IS NOT NULL
-                    """, (start_epoch, end_epoch)).fetchone()[0]
+                    month_total = _rollup_completed_sessions(conn, start_epoch, end_epoch)
                     
                     if month_total > 0:
                         monthly_data.append({
@@ -282,7 +923,8 @@ def update_historical_summary():
             print(f"Error getting monthly data from sessions: {e}")
     
     # Fallback to log files for monthly data if sessions failed
-    if not monthly_data:
+    if not monthly_data and log_fallback_needed():
+        deadline_at = time.monotonic() + LOG_SCAN_DEADLINE
         for month_offset in range(6):
             # Calculate the month start date for each month offset
             current_month = today.month
@@ -299,24 +941,17 @@ def update_historical_summary():
             
             month_start = datetime.datetime(target_year, target_month, 1)
             
-            month_total = 0
-            current_day = month_start
-            while current_day.month == month_start.month and current_day.year == month_start.year:
-                log_path = os.path.join(LOG_DIR, str(current_day.year), str(current_day.month), f"{current_day.day}.json")
-                if os.path.exists(log_path):
-                    try:
-                        with open(log_path, 'r') as log_file:
-                            log_data = json.load(log_file)
-                            month_total += len(log_data)
-                    except (json.JSONDecodeError, FileNotFoundError):
-                        pass
-                current_day += datetime.timedelta(days=1)
-        
-        if month_total > 0:
-            monthly_data.append({
-                "month_of": month_start.strftime("%Y-%m"),
-                "total": month_total
-            })
+            try:
+                month_total = sum(len(log_data) for log_data in scan_log_files(legacy_month_log_paths(month_start), deadline_at))
+            except TimeoutError as e:
+                print(f"Monthly log fallback stopped early: {e}")
+                break
+            
+            if month_total > 0:
+                monthly_data.append({
+                    "month_of": month_start.strftime("%Y-%m"),
+                    "total": month_total
+                })
     
     # Save updated data
     summary_data = {
@@ -330,237 +965,158 @@ def update_historical_summary():
         json.dump(summary_data, f, indent=4)
 
 
-def get_passenger_counts_from_ingest():
+def get_passenger_counts_from_ingest(exact=False):
     """Get passenger counts from ingest database for different time periods"""
+    # Served from memory; the writer thread keeps these current
+    if not exact and live_counters.warmed:
+        return live_counters.counts()
+    
     try:
         conn = _events_db_conn()
         if not conn or not _events_table_exists(conn):
             return None
         
         now = datetime.datetime.now()
-        counts = defaultdict(int)
-        
-        # Daily count (today) - count unique passengers only
-        start_of_day = now.replace(hour=0, minute=0, second=0, microsecond=0)
-        start_epoch = start_of_day.timestamp()
         now_epoch = now.timestamp()
+        start_of_day = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        start_of_week = start_of_day - datetime.timedelta(days=now.weekday())
+        start_of_month = start_of_day.replace(day=1)
         
-        daily_sql = """
-          SELECT DISTINCT json_extract(payload_json, '$.payload_json') as nested_payload
-          FROM events
-          WHERE event_time_utc >= ? AND event_time_utc <= ?
-            AND json_extract(payload_json, '$.payload_json') LIKE '%"entry_timestamp"%'
-            AND json_extract(payload_json, '$.payload_json') LIKE '%"exit_timestamp"%'
-        """
-        
-        daily_rows = conn.execute(daily_sql, (start_epoch, now_epoch)).fetchall()
-        daily_passengers = set()
-        for row in daily_rows:
-            try:
-                nested_payload = row["nested_payload"]
-                if isinstance(nested_payload, str):
-                    nested_payload = json.loads(nested_payload)
-                if "person_id" in nested_payload and nested_payload.get('exit_timestamp') is not None:
-                    daily_passengers.add(nested_payload['person_id'])
-            except:
-                continue
-        counts['daily'] = len(daily_passengers)
-        
-        # Hourly count (rolling) - count unique passengers only
-        hour_ago_epoch = (now - datetime.timedelta(hours=1)).timestamp()
-        
-        hourly_sql = """
-          SELECT DISTINCT json_extract(payload_json, '$.payload_json') as nested_payload
-          FROM events
-          WHERE event_time_utc >= ? AND event_time_utc <= ?
-            AND json_extract(payload_json, '$.payload_json') LIKE '%"entry_timestamp"%'
-            AND json_extract(payload_json, '$.payload_json') LIKE '%"exit_timestamp"%'
-        """
-        
-        hourly_rows = conn.execute(hourly_sql, (hour_ago_epoch, now_epoch)).fetchall()
-        hourly_passengers = set()
-        for row in hourly_rows:
-            try:
-                nested_payload = row["nested_payload"]
-                if isinstance(nested_payload, str):
-                    nested_payload = json.loads(nested_payload)
-                if "person_id" in nested_payload and nested_payload.get('exit_timestamp') is not None:
-                    hourly_passengers.add(nested_payload['person_id'])
-            except:
-                continue
-        counts['hourly'] = len(hourly_passengers)
-        
-        # Weekly count - count unique passengers only
-        start_of_week = now - datetime.timedelta(days=now.weekday())
-        start_of_week = start_of_week.replace(hour=0, minute=0, second=0, microsecond=0)
-        week_start_epoch = start_of_week.timestamp()
-        
-        weekly_sql = """
-          SELECT DISTINCT json_extract(payload_json, '$.payload_json') as nested_payload
-          FROM events
-          WHERE event_time_utc >= ? AND event_time_utc <= ?
-            AND json_extract(payload_json, '$.payload_json') LIKE '%"entry_timestamp"%'
-            AND json_extract(payload_json, '$.payload_json') LIKE '%"exit_timestamp"%'
-        """
-        
-        weekly_rows = conn.execute(weekly_sql, (week_start_epoch, now_epoch)).fetchall()
-        weekly_passengers = set()
-        for row in weekly_rows:
-            try:
-                nested_payload = row["nested_payload"]
-                if isinstance(nested_payload, str):
-                    nested_payload = json.loads(nested_payload)
-                if "person_id" in nested_payload and nested_payload.get('exit_timestamp') is not None:
-                    weekly_passengers.add(nested_payload['person_id'])
-            except:
-                continue
-        counts['weekly'] = len(weekly_passengers)
-        
-        # Monthly count - count unique passengers only
-        start_of_month = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-        month_start_epoch = start_of_month.timestamp()
-        
-        monthly_sql = """
-          SELECT DISTINCT json_extract(payload_json, '$.payload_json') as nested_payload
-          FROM events
-          WHERE event_time_utc >= ? AND event_time_utc <= ?
-            AND json_extract(payload_json, '$.payload_json') LIKE '%"entry_timestamp"%'
-            AND json_extract(payload_json, '$.payload_json') LIKE '%"exit_timestamp"%'
-        """
-        
-        monthly_rows = conn.execute(monthly_sql, (month_start_epoch, now_epoch)).fetchall()
-        monthly_passengers = set()
-        for row in monthly_rows:
-            try:
-                nested_payload = row["nested_payload"]
-                if isinstance(nested_payload, str):
-                    nested_payload = json.loads(nested_payload)
-                if "person_id" in nested_payload and nested_payload.get('exit_timestamp') is not None:
-                    monthly_passengers.add(nested_payload['person_id'])
-            except:
-                continue
-        counts['monthly'] = len(monthly_passengers)
+        # Unique passengers with completed trips. The rolling hour never lines up
+        # with sketch buckets and only spans an hour of sessions, so count it exactly.
+        counts = {
+            'hourly': count_unique_passengers(conn, (now - datetime.timedelta(hours=1)).timestamp(), now_epoch, exact=True),
+            'daily': count_unique_passengers(conn, start_of_day.timestamp(), now_epoch, exact=exact),
+            'weekly': count_unique_passengers(conn, start_of_week.timestamp(), now_epoch, exact=exact),
+            'monthly': count_unique_passengers(conn, start_of_month.timestamp(), now_epoch, exact=exact),
+        }
         
         conn.close()
-        return dict(counts)
+        return counts
         
     except Exception as e:
         print(f"Error getting passenger counts from ingest: {e}")
         return None
 
-def get_passenger_counts():
+def get_passenger_counts(exact=False):
     """Calculates passenger counts for different time periods."""
     # Try ingest database first if enabled
     if USE_INGEST:
-        ingest_counts = get_passenger_counts_from_ingest()
+        ingest_counts = get_passenger_counts_from_ingest(exact=exact)
         if ingest_counts is not None:
             return ingest_counts
     
     # Fallback to log files
     now = get_latest_log_time()
-    counts = defaultdict(int) # Simple defaultdict for totals
-
-    # Hourly and Daily
-    today_log_path = os.path.join(LOG_DIR, str(now.year), str(now.month), f"{now.day}.json")
-    today_data = get_combined_data_for_date(now.year, now.month, now.day)
+    today = now.date()
+    start_of_week = today - datetime.timedelta(days=now.weekday())
+    start_of_month = today.replace(day=1)
     
-    if today_data:
-        # Daily count - count unique passengers only
-        unique_passengers = set()
-        for entry in today_data:
-            # Only count entries with valid exit timestamps (completed trips)
-            if entry.get('exit_timestamp') is not None:
-                unique_passengers.add(entry['person_id'])
-        counts['daily'] = len(unique_passengers)
-        
-        # Hourly count (rolling) - count unique passengers only
-        hourly_passengers = set()
-        for entry in today_data:
-            # Convert timestamp to local time
-            entry_time = datetime.datetime.fromtimestamp(entry['entry_timestamp'])
-            if (now - entry_time).total_seconds() <= 3600 and entry.get('exit_timestamp') is not None:
-                hourly_passengers.add(entry['person_id'])
-        counts['hourly'] = len(hourly_passengers)
-
-    # Weekly - count unique passengers only
-    start_of_week = now - datetime.timedelta(days=now.weekday())
+    # Count unique passengers only, reading each day once for every window it belongs to
+    hourly_passengers = set()
+    daily_passengers = set()
     weekly_passengers = set()
-    for i in range(7):
-        current_day = start_of_week + datetime.timedelta(days=i)
-        day_data = get_combined_data_for_date(current_day.year, current_day.month, current_day.day)
-        for entry in day_data:
-            if entry.get('exit_timestamp') is not None:
-                weekly_passengers.add(entry['person_id'])
-    counts['weekly'] = len(weekly_passengers)
-    
-    # Monthly - count unique passengers only
-    month_log_dir = os.path.join(LOG_DIR, str(now.year), str(now.month))
     monthly_passengers = set()
-    if os.path.exists(month_log_dir):
-        for day_file in os.listdir(month_log_dir):
-            if day_file.endswith('.json') and not '_' in day_file:  # Skip device-specific files
-                day_path = os.path.join(month_log_dir, day_file)
-                day_data = get_combined_data_for_date(now.year, now.month, int(day_file.replace('.json', '')))
-                for entry in day_data:
-                    if entry.get('exit_timestamp') is not None:
-                        monthly_passengers.add(entry['person_id'])
-    counts['monthly'] = len(monthly_passengers)
-
-    return dict(counts)
+    current_day = min(start_of_week, start_of_month)
+    while current_day <= today:
+        for entry in get_combined_data_for_date(current_day.year, current_day.month, current_day.day):
+            # Only count entries with valid exit timestamps (completed trips)
+            if entry.get('exit_timestamp') is None:
+                continue
+            person_id = entry.get('person_id')
+            if current_day >= start_of_month:
+                monthly_passengers.add(person_id)
+            if current_day >= start_of_week:
+                weekly_passengers.add(person_id)
+            if current_day == today:
+                daily_passengers.add(person_id)
+                # Hourly count (rolling)
+                entry_time = datetime.datetime.fromtimestamp(entry['entry_timestamp'])
+                if (now - entry_time).total_seconds() <= 3600:
+                    hourly_passengers.add(person_id)
+        current_day += datetime.timedelta(days=1)
+    
+    return {
+        'hourly': len(hourly_passengers),
+        'daily': len(daily_passengers),
+        'weekly': len(weekly_passengers),
+        'monthly': len(monthly_passengers),
+    }
 
 def get_combined_data_for_date(year, month, day):
     """Get combined data from all Pi devices for a specific date"""
     combined_data = []
-    log_dir = os.path.join(LOG_DIR, str(year), str(month))
-    
-    if not os.path.exists(log_dir):
-        return combined_data
-    
-    # Look for device-specific files (e.g., 23_PI001.json, 23_PI002.json)
-    for filename in os.listdir(log_dir):
-        if filename.startswith(f"{day}_") and filename.endswith('.json'):
-            file_path = os.path.join(log_dir, filename)
-            try:
-                with open(file_path, 'r') as f:
-                    data = json.load(f)
-                    if isinstance(data, list):
-                        combined_data.extend(data)
-                    elif isinstance(data, dict):
-                        combined_data.append(data)
-            except (json.JSONDecodeError, FileNotFoundError):
-                continue
     
-    # Also check for legacy files (e.g., 23.json) for backward compatibility
-    legacy_file = os.path.join(log_dir, f"{day}.json")
-    if os.path.exists(legacy_file):
+    # Device-specific files (e.g., 23_PI001.json) and legacy files (e.g., 23.json)
+    for file_path in manifest_log_files(year, month, day):
         try:
-            with open(legacy_file, 'r') as f:
-                data = json.load(f)
-                if isinstance(data, list):
-                    combined_data.extend(data)
-                elif isinstance(data, dict):
-                    combined_data.append(data)
+            data = read_log_file(file_path)
+            if isinstance(data, list):
+                combined_data.extend(data)
+            elif isinstance(data, dict):
+                combined_data.append(data)
         except (json.JSONDecodeError, FileNotFoundError):
-            pass
+            continue
     
     return combined_data
 
 # Database helper functions for ingest system
-def _events_db_conn():
-    """Get database connection and ensure tables exist"""
-    # Create database file if it doesn't exist
-    conn = sqlite3.connect(EVENTS_DB_PATH)
+class _PooledConnection(sqlite3.Connection):
+    """SQLite connection whose close() returns it to the pool instead of closing it"""
+
+    def close(self):
+        _release_events_db_conn(self)
+
+    def close_for_real(self):
+        sqlite3.Connection.close(self)
+
+# Idle connections ready for reuse (LIFO so the warmest connection is reused first)
+_events_db_pool = queue.LifoQueue(maxsize=EVENTS_DB_POOL_SIZE)
+_events_db_init_lock = threading.Lock()
+_events_db_initialized = False
+
+def _open_events_db_conn():
+    """Open a new tuned connection to the events database"""
+    conn = sqlite3.connect(EVENTS_DB_PATH, timeout=30, check_same_thread=False, factory=_PooledConnection)
     conn.row_factory = sqlite3.Row
-    # Enable JSON1 if available (bundled in modern sqlite)
-    try:
-        conn.execute("SELECT json('[]')")
-    except:
-        pass
-    
-    # Always ensure tables exist (safe to run multiple times)
-    _ensure_tables_exist(conn)
+    # WAL lets dashboard readers run while an ingest is writing
+    conn.execute("PRAGMA journal_mode=WAL")
+    # NORMAL is durable across application crashes in WAL mode and avoids an fsync per commit
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA cache_size=-{EVENTS_DB_CACHE_KB}")
+    conn.execute(f"PRAGMA mmap_size={EVENTS_DB_MMAP_BYTES}")
+    conn.execute("PRAGMA temp_store=MEMORY")
     return conn
 
+def init_events_db():
+    """Create the events database schema once per process"""
+    global _events_db_initialized
+    with _events_db_init_lock:
+        if _events_db_initialized:
+            return
+        conn = _open_events_db_conn()
+        _ensure_tables_exist(conn)
+        _events_db_initialized = True
+        conn.close()
+
+def _events_db_conn():
+    """Get a pooled database connection (call close() to hand it back)"""
+    if not _events_db_initialized:
+        init_events_db()
+    try:
+        return _events_db_pool.get_nowait()
+    except queue.Empty:
+        return _open_events_db_conn()
+
+def _release_events_db_conn(conn):
+    """Return a connection to the pool, discarding any uncommitted work"""
+    try:
+        if conn.in_transaction:
+            conn.rollback()
+        _events_db_pool.put_nowait(conn)
+    except (queue.Full, sqlite3.Error):
+        conn.close_for_real()
+
 def _ensure_tables_exist(conn):
     """Create sessions and events tables if they don't exist"""
     # Sessions table - one row per ride
@@ -590,7 +1146,26 @@ def _ensure_tables_exist(conn):
             event_id TEXT UNIQUE NOT NULL,
             event_time_utc REAL NOT NULL,
             payload_json TEXT NOT NULL,
-            type TEXT DEFAULT 'PASSENGER'
+            type TEXT DEFAULT 'PASSENGER',
+            person_id INTEGER,
+            entry_timestamp REAL,
+            exit_timestamp REAL,
+            toda_id TEXT,
+            etrike_id TEXT,
+            kind TEXT
+        )
+    """)
+    
+    _migrate_events_columns(conn)
+    
+    # Log files already imported into sessions, as of the size/mtime they had then
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS log_import_checkpoints (
+            path TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            sessions INTEGER NOT NULL,
+            imported_at REAL NOT NULL
         )
     """)
     
@@ -598,9 +1173,477 @@ def _ensure_tables_exist(conn):
     conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_device_entry ON sessions(device_id, entry_timestamp)")
     conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_timestamps ON sessions(entry_timestamp, exit_timestamp)")
     conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_open ON sessions(device_id, exit_timestamp) WHERE exit_timestamp IS NULL")
+    _create_session_rollups(conn)
+    _create_passenger_sketches(conn)
+    
+    # Covers the period counts so they never touch payload_json
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_events_entry ON events(entry_timestamp, exit_timestamp, person_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_events_device_seq ON events(device_id, seq)")
+    
+    conn.commit()
+
+# Payload fields stored as real columns on the events table
+EVENT_PAYLOAD_COLUMNS = [
+    ("person_id", "INTEGER"),
+    ("entry_timestamp", "REAL"),
+    ("exit_timestamp", "REAL"),
+    ("toda_id", "TEXT"),
+    ("etrike_id", "TEXT"),
+    ("kind", "TEXT"),
+]
+
+def _migrate_events_columns(conn):
+    """Add the payload columns to an older events table and backfill them once"""
+    existing = {row[1] for row in conn.execute("PRAGMA table_info(events)")}
+    for name, decl in EVENT_PAYLOAD_COLUMNS:
+        if name not in existing:
+            conn.execute(f"ALTER TABLE events ADD COLUMN {name} {decl}")
+    
+    if conn.execute("PRAGMA user_version").fetchone()[0] >= 1:
+        return
+    
+    print("[INGEST] Backfilling payload columns on events table...")
+    backfilled = 0
+    last_seq = -1
+    while True:
+        rows = conn.execute(
+            "SELECT seq, payload_json FROM events WHERE seq > ? ORDER BY seq LIMIT 5000", (last_seq,)
+        ).fetchall()
+        if not rows:
+            break
+        updates = []
+        for row in rows:
+            try:
+                fields = _event_payload_fields(_event_payload(json.loads(row["payload_json"])))
+            except (ValueError, TypeError, AttributeError):
+                fields = (None,) * len(EVENT_PAYLOAD_COLUMNS)
+            updates.append(fields + (row["seq"],))
+        conn.executemany("""
+            UPDATE events SET person_id = ?, entry_timestamp = ?, exit_timestamp = ?,
+                              toda_id = ?, etrike_id = ?, kind = ?
+            WHERE seq = ?
+        """, updates)
+        backfilled += len(rows)
+        last_seq = rows[-1]["seq"]
+    
+    conn.execute("PRAGMA user_version = 1")
+    conn.commit()
+    print(f"[INGEST] Backfilled {backfilled} events")
+
+# Hour bucket (epoch seconds) of a session's entry time: the start of its local
+# hour, so buckets line up with local days even with half-hour UTC offsets.
+# Must match _local_hour_start (SQLite and Python share the C library's localtime).
+_ROLLUP_HOUR_SQL = ("(CAST({ts} AS INTEGER)"
+                    " - CAST(strftime('%M', {ts}, 'unixepoch', 'localtime') AS INTEGER) * 60"
+                    " - CAST(strftime('%S', {ts}, 'unixepoch', 'localtime') AS INTEGER))")
+
+def _local_hour_start(ts):
+    """Epoch seconds of the start of the local hour containing ts"""
+    local = time.localtime(ts)
+    return int(ts) - local.tm_min * 60 - local.tm_sec
+
+def _create_session_rollups(conn):
+    """
+    Create the hourly rollup of completed sessions and the triggers that keep
+    it current. The triggers run inside the same transaction as the session
+    upsert, so a session is counted exactly when it closes.
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS session_rollups (
+            hour_start INTEGER NOT NULL,
+            device_id TEXT NOT NULL,
+            toda_id TEXT NOT NULL DEFAULT '',
+            etrike_id TEXT NOT NULL DEFAULT '',
+            city TEXT NOT NULL DEFAULT '',
+            completed INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (hour_start, device_id, toda_id, etrike_id, city)
+        )
+    """)
+    
+    old_hour = _ROLLUP_HOUR_SQL.format(ts="OLD.entry_timestamp")
+    new_hour = _ROLLUP_HOUR_SQL.format(ts="NEW.entry_timestamp")
+    count_new_session = f"""
+        INSERT INTO session_rollups (hour_start, device_id, toda_id, etrike_id, city, completed)
+        SELECT {new_hour}, NEW.device_id, COALESCE(NEW.toda_id, ''),
+               COALESCE(NEW.etrike_id, ''), COALESCE(NEW.city, ''), 1
+        WHERE NEW.exit_timestamp IS NOT NULL AND NEW.entry_timestamp IS NOT NULL
+        ON CONFLICT(hour_start, device_id, toda_id, etrike_id, city)
+        DO UPDATE SET completed = completed + 1;
+    """
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_sessions_rollup_insert
+        AFTER INSERT ON sessions
+        WHEN NEW.exit_timestamp IS NOT NULL
+        BEGIN
+            {count_new_session}
+        END
+    """)
+    # Move the session between buckets whenever its closed state, hour or labels change
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_sessions_rollup_update
+        AFTER UPDATE ON sessions
+        WHEN (OLD.exit_timestamp IS NULL) != (NEW.exit_timestamp IS NULL)
+          OR (NEW.exit_timestamp IS NOT NULL AND (
+                {old_hour} IS NOT {new_hour}
+                OR OLD.toda_id IS NOT NEW.toda_id
+                OR OLD.etrike_id IS NOT NEW.etrike_id
+                OR OLD.city IS NOT NEW.city))
+        BEGIN
+            UPDATE session_rollups SET completed = completed - 1
+            WHERE OLD.exit_timestamp IS NOT NULL
+              AND hour_start = {old_hour}
+              AND device_id = OLD.device_id
+              AND toda_id = COALESCE(OLD.toda_id, '')
+              AND etrike_id = COALESCE(OLD.etrike_id, '')
+              AND city = COALESCE(OLD.city, '');
+            {count_new_session}
+        END
+    """)
+    
+    if conn.execute("PRAGMA user_version").fetchone()[0] >= 2:
+        return
+    
+    # One-time backfill from sessions closed before the rollups existed
+    _backfill_session_rollups(conn)
+    conn.execute("PRAGMA user_version = 2")
+    conn.commit()
+
+def _backfill_session_rollups(conn):
+    """Recompute session_rollups from the sessions table"""
+    hour = _ROLLUP_HOUR_SQL.format(ts="entry_timestamp")
+    conn.execute("DELETE FROM session_rollups")
+    conn.execute(f"""
+        INSERT INTO session_rollups (hour_start, device_id, toda_id, etrike_id, city, completed)
+        SELECT {hour}, device_id, COALESCE(toda_id, ''), COALESCE(etrike_id, ''), COALESCE(city, ''), COUNT(*)
+        FROM sessions
+        WHERE exit_timestamp IS NOT NULL AND entry_timestamp IS NOT NULL
+        GROUP BY 1, 2, 3, 4, 5
+    """)
+
+def _rollup_completed_sessions(conn, start_epoch, end_epoch, toda_id=None, etrike_id=None, city=None, device_id=None):
+    """Completed sessions whose entry hour starts within [start_epoch, end_epoch], from the rollups"""
+    row = conn.execute("""
+        SELECT COALESCE(SUM(completed), 0)
+        FROM session_rollups
+        WHERE hour_start >= ? AND hour_start <= ?
+          AND (? IS NULL OR toda_id = ?)
+          AND (? IS NULL OR etrike_id = ?)
+          AND (? IS NULL OR city = ?)
+          AND (? IS NULL OR device_id = ?)
+    """, (start_epoch, end_epoch, toda_id, toda_id, etrike_id, etrike_id, city, city, device_id, device_id)).fetchone()
+    return row[0]
+
+# ============================================================================
+# UNIQUE PASSENGER SKETCHES - mergeable HyperLogLog per hour/day/month
+# ============================================================================
+
+HLL_PRECISION = 11  # 2048 registers, ~2.3% standard error
+HLL_REGISTERS = 1 << HLL_PRECISION
+_HLL_ALPHA = 0.7213 / (1 + 1.079 / HLL_REGISTERS)
+_HLL_INVERSE_POWERS = [2.0 ** -r for r in range(65)]
+
+def _hll_add(registers, value):
+    """Add a value to the registers; returns True if a register changed"""
+    h = int.from_bytes(hashlib.blake2b(str(value).encode(), digest_size=8).digest(), "big")
+    index = h >> (64 - HLL_PRECISION)
+    remainder = h & ((1 << (64 - HLL_PRECISION)) - 1)
+    rank = (64 - HLL_PRECISION) - remainder.bit_length() + 1
+    if rank > registers[index]:
+        registers[index] = rank
+        return True
+    return False
+
+def _hll_merge(registers, other):
+    """Register-wise max of two sketches"""
+    return bytearray(map(max, registers, other))
+
+def _hll_estimate(registers):
+    """Estimate the number of distinct values added to the registers"""
+    z = sum(map(_HLL_INVERSE_POWERS.__getitem__, registers))
+    estimate = _HLL_ALPHA * HLL_REGISTERS * HLL_REGISTERS / z
+    zeros = registers.count(0)
+    if estimate <= 2.5 * HLL_REGISTERS and zeros:
+        # Linear counting is far more accurate for small cardinalities
+        estimate = HLL_REGISTERS * math.log(HLL_REGISTERS / zeros)
+    return int(round(estimate))
+
+def _hll_load(blob):
+    return bytearray(zlib.decompress(blob))
+
+def _hll_dump(registers):
+    # Hourly sketches are almost all zeros and compress to a few dozen bytes
+    return zlib.compress(bytes(registers))
+
+def _create_passenger_sketches(conn):
+    """Create the sketch table and backfill it once from the stored (merged) completed sessions"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS passenger_sketches (
+            granularity TEXT NOT NULL,
+            bucket_start INTEGER NOT NULL,
+            device_id TEXT NOT NULL,
+            toda_id TEXT NOT NULL DEFAULT '',
+            registers BLOB NOT NULL,
+            PRIMARY KEY (granularity, bucket_start, device_id, toda_id)
+        )
+    """)
     
+    if conn.execute("PRAGMA user_version").fetchone()[0] >= 3:
+        return
+    
+    print("[INGEST] Building passenger sketches from sessions...")
+    conn.execute("DELETE FROM passenger_sketches")
+    _backfill_passenger_sketches(conn)
+    conn.execute("PRAGMA user_version = 3")
     conn.commit()
 
+def _backfill_passenger_sketches(conn):
+    """Fold every completed session into its sketches"""
+    last_rowid = 0
+    while True:
+        rows = conn.execute("""
+            SELECT rowid, device_id, person_id, entry_timestamp, exit_timestamp, toda_id
+            FROM sessions WHERE rowid > ? AND exit_timestamp IS NOT NULL
+            ORDER BY rowid LIMIT 20000
+        """, (last_rowid,)).fetchall()
+        if not rows:
+            break
+        _update_passenger_sketches(conn, [dict(row) for row in rows])
+        last_rowid = rows[-1]["rowid"]
+
+def _sketch_buckets(entry_timestamp):
+    """(granularity, bucket_start) of every sketch an entry time falls into"""
+    day_start = datetime.datetime.combine(datetime.datetime.fromtimestamp(entry_timestamp).date(), datetime.time.min)
+    return [
+        ("hour", _local_hour_start(entry_timestamp)),
+        ("day", int(day_start.timestamp())),
+        ("month", int(day_start.replace(day=1).timestamp())),
+    ]
+
+def _update_passenger_sketches(conn, sessions):
+    """Fold the person_ids of completed sessions into their hour/day/month sketches"""
+    pending = defaultdict(list)
+    for s in sessions:
+        if s.get("exit_timestamp") is None or s.get("person_id") is None or not s.get("entry_timestamp"):
+            continue
+        for granularity, bucket_start in _sketch_buckets(s["entry_timestamp"]):
+            pending[(granularity, bucket_start, s["device_id"], s.get("toda_id") or '')].append(s["person_id"])
+    
+    for key, person_ids in pending.items():
+        row = conn.execute("""
+            SELECT registers FROM passenger_sketches
+            WHERE granularity = ? AND bucket_start = ? AND device_id = ? AND toda_id = ?
+        """, key).fetchone()
+        registers = _hll_load(row[0]) if row else bytearray(HLL_REGISTERS)
+        changed = False
+        for person_id in person_ids:
+            changed = _hll_add(registers, person_id) or changed
+        if changed or row is None:
+            conn.execute("INSERT OR REPLACE INTO passenger_sketches VALUES (?, ?, ?, ?, ?)",
+                         key + (_hll_dump(registers),))
+
+def _sketch_cover(start_epoch, end_epoch):
+    """
+    Split [start_epoch, end_epoch] into the fewest month/day/hour buckets.
+    The start is rounded down to the local hour. Buckets hold nothing after now,
+    so a window that ends now may use the month/day still in progress.
+    """
+    # (the caller read the clock a moment ago, so allow a little slack)
+    limit = float("inf") if end_epoch + 60 >= time.time() else end_epoch
+    t = _local_hour_start(start_epoch)
+    cover = []
+    while t <= end_epoch:
+        local = datetime.datetime.fromtimestamp(t)
+        if local.hour == 0 and local.minute == 0:
+            if local.day == 1:
+                if local.month == 12:
+                    next_month = local.replace(year=local.year + 1, month=1)
+                else:
+                    next_month = local.replace(month=local.month + 1)
+                next_t = int(next_month.timestamp())
+                if next_t - 1 <= limit:
+                    cover.append(("month", t))
+                    t = next_t
+                    continue
+            next_t = int(datetime.datetime.combine(local.date() + datetime.timedelta(days=1), datetime.time.min).timestamp())
+            if next_t - 1 <= limit:
+                cover.append(("day", t))
+                t = next_t
+                continue
+        cover.append(("hour", t))
+        t += 3600
+    return cover
+
+def count_unique_passengers(conn, start_epoch, end_epoch, device_id=None, toda_id=None, exact=False):
+    """
+    Unique passengers (distinct person_id with a completed trip) whose entry
+    falls in [start_epoch, end_epoch]. Merges sketches by default; exact=True
+    runs COUNT(DISTINCT) over sessions for audits.
+    """
+    if exact:
+        return conn.execute("""
+            SELECT COUNT(DISTINCT person_id)
+            FROM sessions
+            WHERE entry_timestamp >= ? AND entry_timestamp <= ?
+              AND exit_timestamp IS NOT NULL
+              AND (? IS NULL OR device_id = ?)
+              AND (? IS NULL OR toda_id = ?)
+        """, (start_epoch, end_epoch, device_id, device_id, toda_id, toda_id)).fetchone()[0]
+    
+    return _hll_estimate(merge_passenger_sketches(conn, start_epoch, end_epoch, device_id, toda_id))
+
+def merge_passenger_sketches(conn, start_epoch, end_epoch, device_id=None, toda_id=None):
+    """Merged HyperLogLog registers covering [start_epoch, end_epoch]"""
+    by_granularity = defaultdict(list)
+    for granularity, bucket_start in _sketch_cover(start_epoch, end_epoch):
+        by_granularity[granularity].append(bucket_start)
+    
+    merged = bytearray(HLL_REGISTERS)
+    for granularity, starts in by_granularity.items():
+        placeholders = ",".join("?" * len(starts))
+        rows = conn.execute(f"""
+            SELECT registers FROM passenger_sketches
+            WHERE granularity = ? AND bucket_start IN ({placeholders})
+              AND (? IS NULL OR device_id = ?)
+              AND (? IS NULL OR toda_id = ?)
+        """, [granularity, *starts, device_id, device_id, toda_id, toda_id])
+        for row in rows:
+            merged = _hll_merge(merged, _hll_load(row[0]))
+    return merged
+
+# ============================================================================
+# LIVE COUNTERS - in-memory passenger counts served by /data
+# ============================================================================
+
+class LiveCounters:
+    """
+    Unique passenger counts for the rolling hour and the current day, week and
+    month, updated by the ingest writer after each commit. The rolling hour is
+    a ring buffer of per-minute person_id sets; the periods are HyperLogLog
+    registers that reset at local midnight / Monday / the 1st.
+    """
+
+    PERIODS = ('daily', 'weekly', 'monthly')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._minutes = [(None, set()) for _ in range(60)]  # slot -> (minute, person_ids)
+        self._period_start = {}
+        self._registers = {p: bytearray(HLL_REGISTERS) for p in self.PERIODS}
+        self._next_rollover = 0
+        self._cached = None
+        self._cached_minute = None
+        self.warmed = False
+
+    def _roll(self, now):
+        """Reset the period registers once a local period boundary has passed"""
+        if now < self._next_rollover:
+            return
+        now_dt = datetime.datetime.fromtimestamp(now)
+        day_start = datetime.datetime.combine(now_dt.date(), datetime.time.min)
+        starts = {
+            'daily': day_start.timestamp(),
+            'weekly': (day_start - datetime.timedelta(days=now_dt.weekday())).timestamp(),
+            'monthly': day_start.replace(day=1).timestamp(),
+        }
+        for period, start in starts.items():
+            if self._period_start.get(period) != start:
+                self._period_start[period] = start
+                self._registers[period] = bytearray(HLL_REGISTERS)
+        self._next_rollover = (day_start + datetime.timedelta(days=1)).timestamp()
+        self._cached = None
+
+    def _add(self, person_id, entry_timestamp, now):
+        minute = int(entry_timestamp // 60)
+        if int(now // 60) - 59 <= minute <= int(now // 60):
+            slot = minute % 60
+            if self._minutes[slot][0] != minute:
+                self._minutes[slot] = (minute, set())
+            self._minutes[slot][1].add(person_id)
+        for period in self.PERIODS:
+            if entry_timestamp >= self._period_start[period]:
+                _hll_add(self._registers[period], person_id)
+
+    def add_sessions(self, sessions):
+        """Count completed sessions from a committed ingest batch"""
+        now = time.time()
+        with self._lock:
+            self._roll(now)
+            for s in sessions:
+                if s.get("exit_timestamp") is None or s.get("person_id") is None or not s.get("entry_timestamp"):
+                    continue
+                self._add(s["person_id"], s["entry_timestamp"], now)
+            self._cached = None
+
+    def counts(self):
+        """Current counts; recomputed only after new sessions or a new minute"""
+        now = time.time()
+        with self._lock:
+            self._roll(now)
+            current_minute = int(now // 60)
+            if self._cached is None or self._cached_minute != current_minute:
+                hourly = set()
+                for minute, person_ids in self._minutes:
+                    if minute is not None and current_minute - 59 <= minute <= current_minute:
+                        hourly |= person_ids
+                self._cached = {'hourly': len(hourly)}
+                for period in self.PERIODS:
+                    self._cached[period] = _hll_estimate(self._registers[period])
+                self._cached_minute = current_minute
+            return dict(self._cached)
+
+    def warm(self, conn):
+        """Rebuild state from the sessions table and passenger sketches after a restart"""
+        now = time.time()
+        with self._lock:
+            self._next_rollover = 0
+            self._roll(now)
+            for period in self.PERIODS:
+                self._registers[period] = merge_passenger_sketches(conn, self._period_start[period], now)
+            self._minutes = [(None, set()) for _ in range(60)]
+            rows = conn.execute("""
+                SELECT person_id, entry_timestamp FROM sessions
+                WHERE entry_timestamp >= ? AND exit_timestamp IS NOT NULL AND person_id IS NOT NULL
+            """, (now - 3600,)).fetchall()
+            for row in rows:
+                minute = int(row["entry_timestamp"] // 60)
+                if minute <= int(now // 60):
+                    slot = minute % 60
+                    if self._minutes[slot][0] != minute:
+                        self._minutes[slot] = (minute, set())
+                    self._minutes[slot][1].add(row["person_id"])
+            self._cached = None
+            self.warmed = True
+
+live_counters = LiveCounters()
+
+def _event_payload(event):
+    """Return the Pi payload of an event, decoding the nested payload_json if present"""
+    if "payload_json" in event:
+        nested = event["payload_json"]
+        if isinstance(nested, str):
+            return json.loads(nested)
+        return nested
+    return event
+
+def _event_kind(payload):
+    """Classify a payload as an 'entry' or 'exit' event (None if neither)"""
+    if payload.get("exit_timestamp") is not None:
+        return "exit"
+    if payload.get("entry_timestamp") is not None:
+        return "entry"
+    return None
+
+def _event_payload_fields(payload):
+    """Values for EVENT_PAYLOAD_COLUMNS, in order"""
+    return (
+        payload.get("person_id"),
+        payload.get("entry_timestamp"),
+        payload.get("exit_timestamp"),
+        payload.get("toda_id"),
+        payload.get("etrike_id"),
+        _event_kind(payload),
+    )
+
 def _events_table_exists(conn):
     """Check if events table exists in the database"""
     try:
@@ -688,85 +1731,796 @@ def get_filtered_data_from_ingest(toda_id=None, etrike_id=None, pi_id=None, days
         print(f"Error getting sessions data: {e}")
         return None
 
-def login_required(f):
-    """Decorator to require login for routes"""
-    from functools import wraps
-    @wraps(f)
-    def decorated_function(*args, **kwargs):
-        if 'logged_in' not in session:
-            return redirect(url_for('login'))
-        return f(*args, **kwargs)
-    return decorated_function
+def login_required(f):
+    """Decorator to require login for routes"""
+    from functools import wraps
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if 'logged_in' not in session:
+            return redirect(url_for('login'))
+        return f(*args, **kwargs)
+    return decorated_function
+
+def bump_data_version():
+    """Invalidate cached responses after new data is stored"""
+    global data_version
+    with _data_version_lock:
+        data_version += 1
+        return data_version
+
+def versioned_response(time_bucket=None, validator=None):
+    """
+    Decorator for polled GET routes. The response is cached per argument set and
+    tagged with a strong ETag built from the data version; If-None-Match is
+    answered with 304. The local date is always part of the ETag, so "today"
+    views roll over at midnight; time_bucket (seconds) also rolls it over for
+    routes whose output depends on the clock, and validator() adds route-specific state.
+    """
+    from functools import wraps
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            etag = f"{_data_version_epoch}-{data_version}-{datetime.date.today():%Y%m%d}"
+            if time_bucket:
+                etag += f"-{int(time.time() // time_bucket)}"
+            if validator:
+                etag += f"-{validator()}"
+            
+            if request.if_none_match.contains(etag):
+                response = app.response_class(status=304)
+            else:
+                key = (request.endpoint, tuple(sorted(request.args.items(multi=True))))
+                with _response_cache_lock:
+                    cached = _response_cache.get(key)
+                    if cached and cached[0] == etag:
+                        _response_cache.move_to_end(key)
+                if cached and cached[0] == etag:
+                    response = app.response_class(cached[1], mimetype=cached[2])
+                else:
+                    response = app.make_response(f(*args, **kwargs))
+                    if response.status_code != 200:
+                        return response
+                    with _response_cache_lock:
+                        _response_cache[key] = (etag, response.get_data(), response.mimetype)
+                        _response_cache.move_to_end(key)
+                        while len(_response_cache) > RESPONSE_CACHE_MAX_ENTRIES:
+                            _response_cache.popitem(last=False)
+            
+            response.set_etag(etag)
+            # Let clients keep the body but revalidate on every poll
+            response.headers['Cache-Control'] = 'no-cache'
+            return response
+        return decorated_function
+    return decorator
+
+# ============================================================================
+# GPS STORE - latest fix and recent history per Pi device, in memory
+# ============================================================================
+
+class GpsStore:
+    """
+    Latest GPS fix and a bounded history per pi_id. add() is O(1); a
+    background thread writes a snapshot whenever fixes arrived since the last one.
+    Latest positions are also bucketed in a uniform grid of GPS_GRID_CELL_DEG cells
+    so map queries only touch the cells they cover.
+    """
+
+    def __init__(self, history_size):
+        self._lock = threading.Lock()
+        self._history = {}  # pi_id -> deque of fixes, newest last
+        self._labels = {}  # pi_id -> {'city', 'toda_id', 'etrike_id'} reported by the device
+        self._cells = {}  # (cx, cy) -> {pi_id: (lat, lng)}
+        self._cell_of = {}  # pi_id -> (cx, cy)
+        self._history_size = history_size
+        self._dirty = False
+
+    @staticmethod
+    def _cell(lat, lng):
+        return (math.floor(lng / GPS_GRID_CELL_DEG), math.floor(lat / GPS_GRID_CELL_DEG))
+
+    def _index(self, pi_id, fix):
+        """Move a device to the grid cell of its latest fix (caller holds the lock)"""
+        lat, lng = fix['latitude'], fix['longitude']
+        cell = self._cell(lat, lng)
+        previous = self._cell_of.get(pi_id)
+        if previous is not None and previous != cell:
+            members = self._cells[previous]
+            members.pop(pi_id, None)
+            if not members:
+                del self._cells[previous]
+        self._cells.setdefault(cell, {})[pi_id] = (lat, lng)
+        self._cell_of[pi_id] = cell
+
+    def add(self, fix):
+        """Record a fix as the device's latest position"""
+        self.add_many([fix])
+
+    @staticmethod
+    def _clock_stepped(fix, latest):
+        """
+        True when a fix older than the latest one reflects the Pi's clock stepping
+        back rather than a replay: it is more than GPS_CLOCK_SKEW_TOLERANCE older,
+        and either it is live (stamped within the tolerance of when we received it)
+        or the latest fix was stamped that far ahead of its own arrival.
+        """
+        if _fix_timestamp(latest) - _fix_timestamp(fix) <= GPS_CLOCK_SKEW_TOLERANCE:
+            return False
+        offset, latest_offset = _clock_offset(fix), _clock_offset(latest)
+        return ((offset is not None and abs(offset) <= GPS_CLOCK_SKEW_TOLERANCE)
+                or (latest_offset is not None and latest_offset < -GPS_CLOCK_SKEW_TOLERANCE))
+
+    def add_many(self, fixes):
+        """
+        Record fixes in order; ones older than a device's latest fix (replays) are
+        skipped unless the Pi's clock stepped back. Returns how many were skipped.
+        """
+        accepted = []
+        skipped = 0
+        with self._lock:
+            for fix in fixes:
+                history = self._history.get(fix['pi_id'])
+                if history is None:
+                    history = self._history[fix['pi_id']] = deque(maxlen=self._history_size)
+                elif (history and _fix_timestamp(fix) < _fix_timestamp(history[-1])
+                      and not self._clock_stepped(fix, history[-1])):
+                    skipped += 1
+                    continue
+                history.append(fix)
+                self._index(fix['pi_id'], fix)
+                self._dirty = True
+                accepted.append(fix)
+        for fix in accepted:
+            vehicle_motion.update(fix)
+        if accepted:
+            gps_broadcaster.notify_fix()
+        return skipped
+
+    def _cells_in(self, west, south, east, north):
+        """Occupied cells overlapping a bbox (caller holds the lock)"""
+        x0, y0 = self._cell(south, west)
+        x1, y1 = self._cell(north, east)
+        if (x1 - x0 + 1) * (y1 - y0 + 1) > len(self._cells):
+            return [(cell, members) for cell, members in self._cells.items()
+                    if x0 <= cell[0] <= x1 and y0 <= cell[1] <= y1]
+        cells = []
+        for cx in range(x0, x1 + 1):
+            for cy in range(y0, y1 + 1):
+                members = self._cells.get((cx, cy))
+                if members:
+                    cells.append(((cx, cy), members))
+        return cells
+
+    def in_bbox(self, west, south, east, north):
+        """pi_ids whose latest fix lies inside a bbox"""
+        with self._lock:
+            return [pi_id for _, members in self._cells_in(west, south, east, north)
+                    for pi_id, (lat, lng) in members.items()
+                    if south <= lat <= north and west <= lng <= east]
+
+    def clusters(self, west, south, east, north, cell_deg, only=None):
+        """
+        Group latest positions in a bbox into square cells of about cell_deg degrees,
+        built from whole grid cells, optionally only for the pi_ids in only.
+        Returns [(count, mean_lat, mean_lng, pi_ids)].
+        """
+        shift = max(0, int(math.log2(max(cell_deg / GPS_GRID_CELL_DEG, 1))))
+        groups = {}
+        with self._lock:
+            for (cx, cy), members in self._cells_in(west, south, east, north):
+                group = groups.setdefault((cx >> shift, cy >> shift), [0, 0.0, 0.0, []])
+                for pi_id, (lat, lng) in members.items():
+                    if only is not None and pi_id not in only:
+                        continue
+                    if south <= lat <= north and west <= lng <= east:
+                        group[0] += 1
+                        group[1] += lat
+                        group[2] += lng
+                        group[3].append(pi_id)
+        return [(n, slat / n, slng / n, pis) for n, slat, slng, pis in groups.values() if n]
+
+    def latest(self, pi_ids=None):
+        """pi_id -> latest fix, for every device or just the given pi_ids"""
+        with self._lock:
+            if pi_ids is None:
+                return {pi_id: history[-1] for pi_id, history in self._history.items() if history}
+            return {pi_id: self._history[pi_id][-1] for pi_id in pi_ids if self._history.get(pi_id)}
+
+    def history(self, pi_id):
+        """Recent fixes of one device, oldest first"""
+        with self._lock:
+            return list(self._history.get(pi_id, ()))
+
+    def set_labels(self, pi_id, **labels):
+        """Remember the city/TODA/e-trike a device reports (ignores blanks and 'unknown')"""
+        labels = {k: v for k, v in labels.items() if v and v != 'unknown'}
+        if not pi_id or not labels:
+            return
+        with self._lock:
+            current = self._labels.setdefault(pi_id, {})
+            if any(current.get(k) != v for k, v in labels.items()):
+                current.update(labels)
+                self._dirty = True
+
+    def labels(self, pi_id):
+        """City/TODA/e-trike last reported by a device"""
+        with self._lock:
+            return dict(self._labels.get(pi_id, {}))
+
+    def labelled(self, city=None, toda_id=None):
+        """pi_ids last reported in a city and/or TODA"""
+        with self._lock:
+            return {pi_id for pi_id, labels in self._labels.items()
+                    if (not city or labels.get('city') == city)
+                    and (not toda_id or labels.get('toda_id') == toda_id)}
+
+    def load(self, path):
+        """Restore from a snapshot, or seed from the legacy gps_data.json log"""
+        legacy_path = os.path.join(LOG_DIR, 'gps_data.json')
+        labels = {}
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                snapshot = json.load(f)
+            fixes_by_pi = snapshot.get('vehicles', {})
+            labels = snapshot.get('labels', {})
+        elif os.path.exists(legacy_path):
+            fixes_by_pi = defaultdict(list)
+            for fix in read_log_file(legacy_path):
+                fixes_by_pi[fix['pi_id']].append(fix)
+        else:
+            return 0
+        with self._lock:
+            for pi_id, fixes in fixes_by_pi.items():
+                self._history[pi_id] = deque(fixes, maxlen=self._history_size)
+                if fixes:
+                    self._index(pi_id, fixes[-1])
+            self._labels.update(labels)
+        for fixes in fixes_by_pi.values():
+            if fixes:
+                vehicle_motion.update(fixes[-1])
+        return len(fixes_by_pi)
+
+    def save(self, path):
+        """Write a snapshot (temp file + rename) if anything changed since the last one"""
+        with self._lock:
+            if not self._dirty:
+                return False
+            snapshot = {pi_id: list(history) for pi_id, history in self._history.items()}
+            labels = {pi_id: dict(l) for pi_id, l in self._labels.items()}
+            self._dirty = False
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'saved_at': time.time(), 'vehicles': snapshot, 'labels': labels}, f)
+        os.replace(tmp_path, path)
+        return True
+
+class TimerWheel:
+    """
+    Hashed timing wheel: schedule() is O(1) and advance() only visits the slots
+    whose tick has passed. Entries more than one rotation away stay in their slot
+    until their round comes.
+    """
+
+    def __init__(self, tick=1.0, slots=512):
+        self._tick = tick
+        self._slots = [[] for _ in range(slots)]
+        self._current = int(time.time() // tick)
+
+    def schedule(self, deadline, item):
+        """Fire item once the wheel advances past deadline (epoch seconds)"""
+        target = max(math.ceil(deadline / self._tick), self._current + 1)
+        self._slots[target % len(self._slots)].append((target, deadline, item))
+
+    def advance(self, now):
+        """Return (deadline, item) for every entry due by now"""
+        target = int(now // self._tick)
+        if target <= self._current:
+            return []
+        due = []
+        steps = min(target - self._current, len(self._slots))
+        for step in range(1, steps + 1):
+            slot = self._slots[(self._current + step) % len(self._slots)]
+            if not slot:
+                continue
+            waiting = [entry for entry in slot if entry[0] > target]
+            due.extend((deadline, item) for tick, deadline, item in slot if tick <= target)
+            slot[:] = waiting
+        self._current = target
+        return due
+
+class VehicleMotion:
+    """
+    Incremental motion state per pi_id (moving, idle, parked or offline), with the
+    time the state was entered and the anchor position the vehicle is measured
+    against. Fixes update it in O(1); time-based transitions (idle, parked,
+    offline) fire from a timer wheel, so reading a status is a dict lookup.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._states = {}  # pi_id -> dict(state, since, anchor, anchored_at, last_seen, last_update, deadline)
+        self._wheel = TimerWheel()
+
+    @staticmethod
+    def _distance_m(a, b):
+        """Equirectangular distance in metres, accurate at GPS-jitter scales"""
+        kx = 111320.0 * math.cos(math.radians((a[0] + b[0]) / 2))
+        return math.hypot((b[1] - a[1]) * kx, (b[0] - a[0]) * 110540.0)
+
+    @staticmethod
+    def _next_deadline(st):
+        """When this vehicle's state changes next unless a fix arrives"""
+        if st['state'] == 'offline':
+            return None
+        deadline = st['last_seen'] + GPS_OFFLINE_AFTER
+        if st['state'] == 'moving':
+            deadline = min(deadline, st['anchored_at'] + GPS_IDLE_AFTER)
+        elif st['state'] == 'idle':
+            deadline = min(deadline, st['anchored_at'] + GPS_PARK_AFTER)
+        return deadline
+
+    def _schedule(self, pi_id, st):
+        """Keep one wheel entry per vehicle; a later deadline is picked up when the earlier one fires"""
+        deadline = self._next_deadline(st)
+        if deadline is not None and (st['deadline'] is None or deadline < st['deadline']):
+            st['deadline'] = deadline
+            self._wheel.schedule(deadline, pi_id)
+
+    @staticmethod
+    def _settle(st, now):
+        """Apply every time-based transition that is due by now"""
+        offline_at = st['last_seen'] + GPS_OFFLINE_AFTER
+        if now >= offline_at:
+            st['state'], st['since'] = 'offline', offline_at
+            return
+        if st['state'] == 'moving' and now >= st['anchored_at'] + GPS_IDLE_AFTER:
+            st['state'], st['since'] = 'idle', st['anchored_at'] + GPS_IDLE_AFTER
+        if st['state'] == 'idle' and now >= st['anchored_at'] + GPS_PARK_AFTER:
+            st['state'], st['since'] = 'parked', st['anchored_at'] + GPS_PARK_AFTER
+
+    def _advance(self, now):
+        """Run expired timers (caller holds the lock)"""
+        for deadline, pi_id in self._wheel.advance(now):
+            st = self._states.get(pi_id)
+            if st is None or st['deadline'] != deadline:
+                continue  # superseded by an earlier entry
+            st['deadline'] = None
+            self._settle(st, now)
+            self._schedule(pi_id, st)
+
+    def update(self, fix):
+        """Fold a device's newest fix into its motion state"""
+        pi_id = fix['pi_id']
+        ts = _fix_timestamp(fix)
+        position = (fix['latitude'], fix['longitude'])
+        last_update = datetime.datetime.fromtimestamp(ts, tz=datetime.timezone.utc).isoformat()
+        with self._lock:
+            st = self._states.get(pi_id)
+            if st is not None and ts < st['last_seen']:
+                # The Pi's clock stepped back; keep the elapsed times on the new clock
+                step = st['last_seen'] - ts
+                st['since'] -= step
+                st['anchored_at'] -= step
+            if st is None:
+                st = self._states[pi_id] = {'state': 'idle', 'since': ts, 'anchor': position,
+                                            'anchored_at': ts, 'deadline': None}
+            elif self._distance_m(st['anchor'], position) > GPS_MOVE_THRESHOLD_M:
+                if st['state'] != 'moving':
+                    st['state'], st['since'] = 'moving', ts
+                st['anchor'], st['anchored_at'] = position, ts
+            elif st['state'] == 'offline':
+                # Back online at the same spot
+                stationary = ts - st['anchored_at']
+                st['state'] = 'parked' if stationary >= GPS_PARK_AFTER else 'idle'
+                st['since'] = ts
+            st['last_seen'] = ts
+            st['last_update'] = last_update
+            self._settle(st, time.time())
+            self._schedule(pi_id, st)
+
+    def get(self, pi_id):
+        """Current motion state of a device, or None if it never sent a fix"""
+        with self._lock:
+            self._advance(time.time())
+            st = self._states.get(pi_id)
+            return dict(st) if st else None
+
+vehicle_motion = VehicleMotion()
+gps_store = GpsStore(GPS_HISTORY_PER_VEHICLE)
+
+def _gps_snapshot_loop():
+    """Persist gps_store every GPS_SNAPSHOT_INTERVAL seconds"""
+    while True:
+        time.sleep(GPS_SNAPSHOT_INTERVAL)
+        try:
+            os.makedirs(os.path.dirname(GPS_SNAPSHOT_PATH) or '.', exist_ok=True)
+            gps_store.save(GPS_SNAPSHOT_PATH)
+        except Exception as e:
+            print(f"GPS snapshot error: {e}")
+
+# ============================================================================
+# GPS TRACKS - per device per day, fixed-size binary records sorted by time
+# ============================================================================
+
+# timestamp, latitude, longitude, speed, heading
+_TRACK_RECORD = struct.Struct('<dddff')
+
+def _track_path(pi_id, ts):
+    """Track file holding a device's fixes for the local day of ts"""
+    day = datetime.datetime.fromtimestamp(ts)
+    safe_pi = re.sub(r'[^A-Za-z0-9_.-]', '_', str(pi_id))
+    return os.path.join(GPS_TRACK_DIR, f"{day.year:04d}", f"{day.month:02d}", f"{day.day:02d}", f"{safe_pi}.trk")
+
+def _fix_timestamp(fix):
+    """Epoch seconds of a fix, falling back to when it was received"""
+    ts = fix.get('timestamp')
+    if isinstance(ts, (int, float)) and ts > 0:
+        return float(ts)
+    try:
+        return datetime.datetime.fromisoformat(str(ts or fix['received_at'])).timestamp()
+    except (KeyError, ValueError):
+        return time.time()
+
+def _clock_offset(fix):
+    """Seconds between a fix's device timestamp and when we received it, or None if unknown"""
+    try:
+        return datetime.datetime.fromisoformat(fix['received_at']).timestamp() - _fix_timestamp(fix)
+    except (KeyError, TypeError, ValueError):
+        return None
+
+def _track_record_count(path):
+    """Whole records in a track file; a torn trailing record is ignored"""
+    try:
+        return os.path.getsize(path) // _TRACK_RECORD.size
+    except OSError:
+        return 0
+
+def _read_track_records(path):
+    """All records of a track file as tuples"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    usable = len(data) - len(data) % _TRACK_RECORD.size
+    return list(_TRACK_RECORD.iter_unpack(data[:usable]))
+
+def append_track_fixes(pi_id, fixes):
+    """
+    Add fixes to the device's day files. In-order fixes are appended; a fix older
+    than a file's last record (a replay) merges and rewrites that file, so every
+    file stays sorted by time and can be binary searched.
+    """
+    by_path = defaultdict(list)
+    for fix in fixes:
+        ts = _fix_timestamp(fix)
+        by_path[_track_path(pi_id, ts)].append((ts, float(fix['latitude']), float(fix['longitude']),
+                                                float(fix.get('speed', 0) or 0), float(fix.get('heading', 0) or 0)))
+    for path, records in by_path.items():
+        records.sort(key=lambda r: r[0])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with log_path_lock(path):
+            count = _track_record_count(path)
+            last_ts = None
+            if count:
+                with open(path, 'rb') as f:
+                    f.seek((count - 1) * _TRACK_RECORD.size)
+                    last_ts = _TRACK_RECORD.unpack(f.read(_TRACK_RECORD.size))[0]
+            if last_ts is None or records[0][0] >= last_ts:
+                with open(path, 'ab') as f:
+                    if count * _TRACK_RECORD.size != f.tell():
+                        f.truncate(count * _TRACK_RECORD.size)  # drop a torn record
+                    f.write(b''.join(_TRACK_RECORD.pack(*r) for r in records))
+            else:
+                merged = sorted(_read_track_records(path) + records, key=lambda r: r[0])
+                tmp_path = f"{path}.tmp"
+                with open(tmp_path, 'wb') as f:
+                    f.write(b''.join(_TRACK_RECORD.pack(*r) for r in merged))
+                os.replace(tmp_path, path)
+
+# Pending (pi_id, fixes) batches waiting for the track writer thread
+_track_queue = queue.Queue(maxsize=GPS_TRACK_QUEUE_MAX)
+_track_writer_thread = None
+_track_writer_lock = threading.Lock()
+
+def submit_track_fixes(pi_id, fixes):
+    """Queue fixes for the track writer so /gps-data never waits on track files"""
+    global _track_writer_thread
+    with _track_writer_lock:
+        if _track_writer_thread is None or not _track_writer_thread.is_alive():
+            _track_writer_thread = threading.Thread(target=_track_writer_loop, daemon=True)
+            _track_writer_thread.start()
+    try:
+        _track_queue.put_nowait((pi_id, fixes))
+    except queue.Full:
+        # Writer far behind: apply backpressure rather than lose track points
+        print(f"⚠️ Track writer queue full, writing {len(fixes)} fixes for {pi_id} inline")
+        append_track_fixes(pi_id, fixes)
+
+def _track_writer_loop():
+    """Drain queued batches and write them grouped per device, one append or merge per day file"""
+    while True:
+        items = [_track_queue.get()]
+        while len(items) < 1000:
+            try:
+                items.append(_track_queue.get_nowait())
+            except queue.Empty:
+                break
+        by_pi = defaultdict(list)
+        for pi_id, fixes in items:
+            by_pi[pi_id].extend(fixes)
+        for pi_id, fixes in by_pi.items():
+            try:
+                append_track_fixes(pi_id, fixes)
+            except Exception as e:
+                print(f"Track write error for {pi_id}: {e}")
+        for _ in items:
+            _track_queue.task_done()
+
+def flush_track_writer(timeout=10.0):
+    """Wait (bounded) for queued track fixes to reach disk; registered at exit"""
+    deadline = time.monotonic() + timeout
+    while _track_queue.unfinished_tasks and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+def read_track(pi_id, start_ts, end_ts):
+    """Records of one device between two epoch times, oldest first"""
+    records = []
+    day = datetime.datetime.fromtimestamp(start_ts).date()
+    last_day = datetime.datetime.fromtimestamp(end_ts).date()
+    while day <= last_day:
+        day_ts = datetime.datetime.combine(day, datetime.time(12)).timestamp()
+        path = _track_path(pi_id, day_ts)
+        day += datetime.timedelta(days=1)
+        count = _track_record_count(path)
+        if not count:
+            continue
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            size = _TRACK_RECORD.size
+            ts_at = lambda i: struct.unpack_from('<d', mm, i * size)[0]
+            lo = bisect.bisect_left(range(count), start_ts, key=ts_at)
+            hi = bisect.bisect_right(range(count), end_ts, lo=lo, key=ts_at)
+            records.extend(_TRACK_RECORD.iter_unpack(mm[lo * size:hi * size]))
+    return records
+
+def simplify_track(points, tolerance):
+    """
+    Radial-distance pre-filter followed by Douglas-Peucker on (x, y) metres.
+    Returns the indexes of the points kept.
+    """
+    if len(points) <= 2:
+        return list(range(len(points)))
+    tol_sq = tolerance * tolerance
+    
+    # Drop points within tolerance of the last kept one (parked/idle jitter)
+    candidates = [0]
+    for i in range(1, len(points) - 1):
+        px, py = points[candidates[-1]]
+        dx, dy = points[i][0] - px, points[i][1] - py
+        if dx * dx + dy * dy > tol_sq:
+            candidates.append(i)
+    candidates.append(len(points) - 1)
+    
+    xs = [points[i][0] for i in candidates]
+    ys = [points[i][1] for i in candidates]
+    keep = [False] * len(candidates)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(candidates) - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        ax, ay, dx, dy = xs[first], ys[first], xs[last] - xs[first], ys[last] - ys[first]
+        seg_sq = dx * dx + dy * dy
+        seg_xs, seg_ys = xs[first + 1:last], ys[first + 1:last]
+        if seg_sq > tol_sq:
+            # Distance to the line through a and b, via the cross product (list comprehensions keep this fast)
+            cross = [abs(dx * (y - ay) - dy * (x - ax)) for x, y in zip(seg_xs, seg_ys)]
+            worst = max(cross)
+            split = worst * worst > tol_sq * seg_sq
+            if not split:
+                # Equal to segment distance only if every point projects between a and b
+                dots = [(x - ax) * dx + (y - ay) * dy for x, y in zip(seg_xs, seg_ys)]
+                if min(dots) >= 0 and max(dots) <= seg_sq:
+                    continue
+                cross = [(x - ax - dx * t) ** 2 + (y - ay - dy * t) ** 2
+                         for x, y, t in zip(seg_xs, seg_ys, (max(0.0, min(1.0, d / seg_sq)) for d in dots))]
+                worst = max(cross)
+                split = worst > tol_sq
+        else:
+            # a and b (nearly) coincide, e.g. a loop back to the start
+            cross = [(x - ax) ** 2 + (y - ay) ** 2 for x, y in zip(seg_xs, seg_ys)]
+            worst = max(cross)
+            split = worst > tol_sq
+        if split:
+            index = first + 1 + cross.index(worst)
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+    return [candidates[i] for i, kept in enumerate(keep) if kept]
+
+def track_tolerance_metres(zoom, latitude):
+    """Simplification tolerance matching GPS_TRACK_TOLERANCE_PX at a web-map zoom level"""
+    metres_per_pixel = 156543.03392 * math.cos(math.radians(latitude)) / (2 ** zoom)
+    return GPS_TRACK_TOLERANCE_PX * metres_per_pixel
+
+# pi_id -> (last broadcast fields, version); sid -> GPS room
+_gps_vehicle_versions = {}
+_gps_rooms = {}
+
+def _gps_room(city=None, toda_id=None):
+    """Room of a map client: one TODA, one city, or the whole fleet"""
+    if toda_id:
+        return f'gps:toda:{toda_id}'
+    if city:
+        return f'gps:city:{city}'
+    return 'gps:all'
+
+def _vehicle_rooms(vehicle):
+    """Every room that should hear about a vehicle"""
+    rooms = ['gps:all']
+    if vehicle.get('city'):
+        rooms.append(f"gps:city:{vehicle['city']}")
+    if vehicle.get('toda'):
+        rooms.append(f"gps:toda:{vehicle['toda']}")
+    return rooms
+
+def _vehicles_in_room(vehicles, room):
+    """Vehicles a room's clients are viewing"""
+    return [v for v in vehicles if room in _vehicle_rooms(v)]
+
+def _changed_vehicles(vehicles):
+    """Vehicles whose position, status or speed changed since the last tick, with bumped versions.
+
+    Returns (changed, departed); departed maps a room to the pis whose
+    TODA/city relabel moved them out of it.
+    """
+    changed = []
+    departed = defaultdict(list)
+    for vehicle in vehicles:
+        fields = (vehicle['lat'], vehicle['lng'], vehicle['status'], vehicle['speed'],
+                  vehicle['heading'], vehicle.get('toda'), vehicle.get('city'))
+        previous = _gps_vehicle_versions.get(vehicle['pi'])
+        if previous and previous[0] == fields:
+            vehicle['version'] = previous[1]
+            continue
+        version = previous[1] + 1 if previous else 1
+        _gps_vehicle_versions[vehicle['pi']] = (fields, version)
+        vehicle['version'] = version
+        changed.append(vehicle)
+        if previous and previous[0][5:] != fields[5:]:
+            old_rooms = _vehicle_rooms({'toda': previous[0][5], 'city': previous[0][6]})
+            for room in set(old_rooms) - set(_vehicle_rooms(vehicle)):
+                departed[room].append(vehicle['pi'])
+    return changed, departed
 
 def broadcast_gps_updates():
-    """Background thread to broadcast GPS updates via WebSocket"""
-    if not SOCKETIO_AVAILABLE:
-        return
-        
-    global stop_broadcast
-    while not stop_broadcast:
-        try:
-            # Get current vehicle locations
-            vehicles = get_vehicle_locations_data()
-            if vehicles:
-                # Broadcast to all connected clients
-                socketio.emit('gps_update', {'vehicles': vehicles}, namespace='/')
-            time.sleep(1)  # Update every 1 second
-        except Exception as e:
-            print(f"GPS broadcast error: {e}")
-            time.sleep(5)  # Wait 5 seconds on error
+    """Send each GPS room the vehicles that changed or left it; returns how many changed"""
+    changed, departed = _changed_vehicles(get_vehicle_locations_data())
+    by_room = defaultdict(list)
+    for vehicle in changed:
+        for room in _vehicle_rooms(vehicle):
+            by_room[room].append(vehicle)
+    for room in set(by_room) | set(departed):
+        socketio.emit('gps_delta', {'vehicles': by_room.get(room, []), 'removed': departed.get(room, [])}, to=room)
+    return len(changed)
 
-def get_vehicle_locations_data():
-    """Get vehicle locations data (extracted from the route function)"""
-    try:
-        gps_log_path = os.path.join(LOG_DIR, 'gps_data.json')
-        if not os.path.exists(gps_log_path):
-            return []
+class GpsBroadcaster:
+    """
+    Runs broadcast_gps_updates only while map clients are subscribed. The thread
+    sleeps on a condition until a fix arrives (or GPS_TICK_MAX passes, so motion
+    status changes still go out), never ticks more often than GPS_TICK_MIN, and
+    parks completely when the last subscriber leaves. Errors back off exponentially.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._subscribers = set()
+        self._pending_since = None  # arrival time of the oldest fix not yet broadcast
+        self._thread = None
+        self._last_behind_warning = 0.0
+        self._stats = {'ticks': 0, 'errors': 0, 'vehicles_sent': 0, 'behind': 0,
+                       'last_tick_ms': 0.0, 'avg_tick_ms': 0.0, 'max_tick_ms': 0.0,
+                       'last_emit_latency_ms': 0.0, 'avg_emit_latency_ms': 0.0, 'max_emit_latency_ms': 0.0}
+
+    def subscribe(self, sid):
+        """Count a map client; starts the thread on first use and wakes it if parked"""
+        with self._cond:
+            if not self._subscribers:
+                self._pending_since = None  # resuming from parked
+            self._subscribers.add(sid)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+                print("GPS broadcast thread started")
+            self._cond.notify()
+
+    def unsubscribe(self, sid):
+        with self._cond:
+            self._subscribers.discard(sid)
 
-        with open(gps_log_path, 'r') as f:
-            gps_data = json.load(f)
+    def notify_fix(self):
+        """Called when fixes are stored; wakes the thread for the next tick"""
+        with self._cond:
+            # While parked nobody is waiting, so the time does not count as emit latency
+            if self._subscribers:
+                if self._pending_since is None:
+                    self._pending_since = time.time()
+                self._cond.notify()
 
-        # Get latest location for each Pi device
-        latest_locations = {}
-        for entry in gps_data:
-            pi_id = entry['pi_id']
-            entry_time = datetime.datetime.fromisoformat(entry['received_at'])
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats['subscribers'] = len(self._subscribers)
+            stats['parked'] = not self._subscribers
+        for key in ('last_tick_ms', 'avg_tick_ms', 'max_tick_ms',
+                    'last_emit_latency_ms', 'avg_emit_latency_ms', 'max_emit_latency_ms'):
+            stats[key] = round(stats[key], 2)
+        return stats
+
+    def _record(self, prefix, value_ms):
+        """Update last/avg (EWMA)/max for a metric (caller holds the lock)"""
+        stats = self._stats
+        stats[f'last_{prefix}_ms'] = value_ms
+        previous = stats[f'avg_{prefix}_ms']
+        stats[f'avg_{prefix}_ms'] = previous * 0.9 + value_ms * 0.1 if previous else value_ms
+        stats[f'max_{prefix}_ms'] = max(stats[f'max_{prefix}_ms'], value_ms)
+
+    def _run(self):
+        last_tick = 0.0
+        backoff = 0.0
+        while True:
+            with self._cond:
+                while not self._subscribers:
+                    self._cond.wait()  # parked: no CPU until someone subscribes
+                if self._pending_since is None:
+                    self._cond.wait(timeout=GPS_TICK_MAX)
+                if not self._subscribers:
+                    continue
+            
+            # Coalesce bursts of fixes into one tick
+            wait = last_tick + GPS_TICK_MIN - time.time()
+            if wait > 0:
+                time.sleep(wait)
+            with self._cond:
+                pending_since, self._pending_since = self._pending_since, None
             
-            if pi_id not in latest_locations or entry_time > datetime.datetime.fromisoformat(latest_locations[pi_id]['received_at']):
-                latest_locations[pi_id] = entry
+            started = time.time()
+            try:
+                sent = broadcast_gps_updates()
+                backoff = 0.0
+            except Exception as e:
+                backoff = min(max(backoff * 2, 1.0), 30.0)
+                with self._cond:
+                    self._stats['errors'] += 1
+                print(f"GPS broadcast error (retrying in {backoff:.0f}s): {e}")
+                time.sleep(backoff)
+                continue
+            last_tick = time.time()
+            
+            tick_ms = (last_tick - started) * 1000
+            with self._cond:
+                self._record('tick', tick_ms)
+                if sent and pending_since is not None:
+                    self._record('emit_latency', (last_tick - pending_since) * 1000)
+                self._stats['ticks'] += 1
+                self._stats['vehicles_sent'] += sent
+                if tick_ms > GPS_TICK_MIN * 1000:
+                    self._stats['behind'] += 1
+            if tick_ms > GPS_TICK_MIN * 1000 and last_tick - self._last_behind_warning > 60:
+                self._last_behind_warning = last_tick
+                print(f"⚠️ GPS broadcast falling behind: tick took {tick_ms:.0f}ms (min interval {GPS_TICK_MIN * 1000:.0f}ms)")
+
+gps_broadcaster = GpsBroadcaster()
+
+def get_vehicle_locations_data(pi_ids=None):
+    """Get vehicle locations data (extracted from the route function), optionally for some pi_ids only"""
+    try:
+        # Latest location for each Pi device
+        latest_locations = gps_store.latest(pi_ids)
 
         # Convert to vehicle format
         vehicles = []
         
         for pi_id, location in latest_locations.items():
-            # Check if vehicle is offline (no data for 5 minutes)
-            pi_timestamp = location.get('timestamp', 0)
-            if pi_timestamp:
-                # Convert UTC timestamp to CET timezone
-                import pytz
-                utc_time = datetime.datetime.fromtimestamp(pi_timestamp, tz=pytz.UTC)
-                last_update = utc_time.astimezone(pytz.timezone('Europe/Madrid'))
-                time_since_update = (datetime.datetime.now(pytz.timezone('Europe/Madrid')) - last_update).total_seconds()
-            else:
-                last_update = datetime.datetime.fromisoformat(location['received_at'])
-                time_since_update = (datetime.datetime.now() - last_update).total_seconds()
-            
-            is_offline = time_since_update > 300  # 5 minutes = 300 seconds
-            is_parked = False
-            if not is_offline and location.get('speed', 0) == 0:
-                is_parked = time_since_update > 600  # 10 minutes = 600 seconds
-            
-            if is_offline:
-                status = 'offline'
-            elif is_parked:
-                status = 'parked'
-            else:
-                status = 'online'
-            
-            if pi_timestamp:
-                last_update_str = last_update.isoformat()
-            else:
-                last_update_str = location['received_at']
+            labels = gps_store.labels(pi_id)
+            motion = vehicle_motion.get(pi_id)
             
             vehicle = {
                 'id': f'pi-{pi_id}',
@@ -775,11 +2529,13 @@ def get_vehicle_locations_data():
                 'lng': location['longitude'],
                 'speed': location.get('speed', 0),
                 'heading': location.get('heading', 0),
-                'status': status,
+                'status': motion['state'],
+                'status_since': motion['since'],
                 'passengers': 0,
-                'toda': '',
+                'toda': labels.get('toda_id', ''),
+                'city': labels.get('city', ''),
                 'pi': pi_id,
-                'last_update': last_update_str
+                'last_update': motion['last_update']
             }
             vehicles.append(vehicle)
         
@@ -794,25 +2550,253 @@ if SOCKETIO_AVAILABLE:
     def handle_connect():
         """Handle client connection"""
         print(f'Client connected: {request.sid}')
-        # Start broadcast thread if not already running
-        global gps_broadcast_thread, stop_broadcast
-        if gps_broadcast_thread is None or not gps_broadcast_thread.is_alive():
-            stop_broadcast = False
-            gps_broadcast_thread = threading.Thread(target=broadcast_gps_updates, daemon=True)
-            gps_broadcast_thread.start()
-            print("GPS broadcast thread started")
 
     @socketio.on('disconnect')
     def handle_disconnect():
         """Handle client disconnection"""
         print(f'Client disconnected: {request.sid}')
+        with _dashboard_push_lock:
+            _dashboard_rooms.pop(request.sid, None)
+        _gps_rooms.pop(request.sid, None)
+        gps_broadcaster.unsubscribe(request.sid)
+
+    @socketio.on('subscribe_dashboard')
+    def handle_subscribe_dashboard(data):
+        """Join the rooms for pushed counts, population graph and Pi status"""
+        if 'logged_in' not in session:
+            return
+        data = data or {}
+        room = _dashboard_counts_room(data.get('filtered'), data.get('toda_id') or None, data.get('etrike_id') or None)
+        with _dashboard_push_lock:
+            previous = _dashboard_rooms.get(request.sid)
+            _dashboard_rooms[request.sid] = room
+        if previous and previous != room:
+            leave_room(previous)
+        join_room(room)
+        join_room('dashboard')
+        _start_dashboard_clock()
+        
+        # Send the current state right away so the client does not wait for the next ingest
+        emit('counts_update', _dashboard_counts_payload(room))
+        emit('population_update', _population_payload())
+        emit('pi_status', {**pi_heartbeats.summary(), 'devices': pi_heartbeats.devices()})
 
     @socketio.on('request_gps_update')
-    def handle_gps_request():
-        """Handle client request for immediate GPS update"""
-        vehicles = get_vehicle_locations_data()
+    def handle_gps_request(data=None):
+        """Join the GPS room for an optional city/TODA and send its full snapshot"""
+        data = data or {}
+        room = _gps_room(data.get('city') or None, data.get('toda_id') or None)
+        previous = _gps_rooms.get(request.sid)
+        if previous and previous != room:
+            leave_room(previous)
+        _gps_rooms[request.sid] = room
+        join_room(room)
+        gps_broadcaster.subscribe(request.sid)
+        
+        vehicles = _vehicles_in_room(get_vehicle_locations_data(), room)
+        for vehicle in vehicles:
+            known = _gps_vehicle_versions.get(vehicle['pi'])
+            vehicle['version'] = known[1] if known else 0
         emit('gps_update', {'vehicles': vehicles})
 
+# ============================================================================
+# DASHBOARD PUSH - counts, population graph and Pi status over Socket.IO
+# ============================================================================
+
+def _dashboard_counts_room(filtered, toda_id=None, etrike_id=None):
+    """Room name for a counts subscription; mirrors the /data vs /get-filtered-data choice"""
+    if not filtered:
+        return 'dashboard:counts'
+    return f"dashboard:filtered:{toda_id or '*'}:{etrike_id or '*'}"
+
+def _dashboard_counts_payload(room):
+    """The same body /data or /get-filtered-data would return for the room"""
+    if room == 'dashboard:counts':
+        return get_passenger_counts()
+    _, _, toda_id, etrike_id = room.split(':', 3)
+    return _filtered_data_payload(
+        toda_id=None if toda_id == '*' else toda_id,
+        etrike_id=None if etrike_id == '*' else etrike_id
+    )
+
+def _population_payload():
+    """Today's population graph, as /historical-population-data returns it"""
+    today = datetime.datetime.now()
+    interval_data, source = get_population_data_for_date(today)
+    return {'date': today.strftime('%Y-%m-%d'), 'hourly_data': interval_data, 'source': source}
+
+def schedule_dashboard_push(sessions=None):
+    """
+    Coalesce ingested sessions into one push every DASHBOARD_PUSH_INTERVAL seconds.
+    Without sessions (uploads, imports, cleanup, clock ticks) every room is refreshed.
+    """
+    global _dashboard_push_timer
+    if not SOCKETIO_AVAILABLE or (sessions is not None and not sessions):
+        return
+    with _dashboard_push_lock:
+        if sessions is None:
+            _dashboard_pending.add(None)
+        for s in sessions or ():
+            _dashboard_pending.add((s.get("toda_id"), s.get("etrike_id")))
+        if _dashboard_push_timer is None:
+            _dashboard_push_timer = threading.Timer(DASHBOARD_PUSH_INTERVAL, _push_dashboard_updates)
+            _dashboard_push_timer.daemon = True
+            _dashboard_push_timer.start()
+
+def _push_dashboard_updates():
+    """Emit changed counts to the rooms whose filter matches an ingested session"""
+    global _dashboard_push_timer
+    with _dashboard_push_lock:
+        touched = set(_dashboard_pending)
+        _dashboard_pending.clear()
+        _dashboard_push_timer = None
+        rooms = set(_dashboard_rooms.values())
+    if not rooms:
+        return
+    
+    try:
+        for room in rooms:
+            if room.startswith('dashboard:filtered:') and None not in touched:
+                _, _, toda_id, etrike_id = room.split(':', 3)
+                if not any((toda_id == '*' or toda_id == t) and (etrike_id == '*' or etrike_id == e)
+                           for t, e in touched):
+                    continue
+            _emit_if_changed('counts_update', room, _dashboard_counts_payload(room))
+        _emit_if_changed('population_update', 'dashboard', _population_payload())
+    except Exception as e:
+        print(f"Dashboard push error: {e}")
+
+def _dashboard_clock_loop():
+    """Refresh dashboards on every minute boundary so rolling and daily counts roll over"""
+    while True:
+        time.sleep(60 - time.time() % 60 + 0.05)
+        with _dashboard_push_lock:
+            subscribed = bool(_dashboard_rooms)
+        if subscribed:
+            schedule_dashboard_push()
+
+def _start_dashboard_clock():
+    global _dashboard_clock_thread
+    with _dashboard_push_lock:
+        if _dashboard_clock_thread is None:
+            _dashboard_clock_thread = threading.Thread(target=_dashboard_clock_loop, daemon=True)
+            _dashboard_clock_thread.start()
+
+def _emit_if_changed(event, room, payload):
+    """Emit only when the payload differs from what the room last received"""
+    key = (event, room)
+    if _dashboard_last_pushed.get(key) == payload:
+        return
+    _dashboard_last_pushed[key] = payload
+    socketio.emit(event, payload, to=room)
+
+class PiHeartbeats:
+    """
+    Last heartbeat per pi_id. touch() is O(log n): a device keeps at most one
+    entry in a deadline heap, and an expiry thread sleeps until the earliest
+    deadline instead of scanning. Live/stale transitions are pushed to dashboards
+    as 'pi_device_status' only when they happen, and the fleet 'pi_status' only
+    when the first device comes online or the last one goes stale (its
+    last_heartbeat is as of that edge; dashboards track devices from the
+    per-device events).
+    """
+
+    def __init__(self, timeout):
+        self._timeout = timeout
+        self._cond = threading.Condition()
+        self._last_seen = {}  # pi_id -> epoch seconds
+        self._latest = 0  # newest heartbeat from any device
+        self._live = set()
+        self._heap = []  # (deadline, pi_id)
+        self._scheduled = {}  # pi_id -> deadline of its heap entry
+        self._thread = None
+        self.version = 0  # bumped on every live/stale transition
+
+    def touch(self, pi_id):
+        """Record a heartbeat from a device"""
+        pi_id = str(pi_id or 'unknown')
+        now = time.time()
+        with self._cond:
+            self._last_seen[pi_id] = now
+            self._latest = now
+            came_online = pi_id not in self._live
+            if came_online:
+                self._live.add(pi_id)
+                self.version += 1
+            if pi_id not in self._scheduled:
+                deadline = now + self._timeout
+                self._scheduled[pi_id] = deadline
+                heapq.heappush(self._heap, (deadline, pi_id))
+                if self._heap[0][1] == pi_id:
+                    self._cond.notify()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._expire_loop, daemon=True)
+                self._thread.start()
+            summary = self._summary() if came_online and len(self._live) == 1 else None
+        if came_online:
+            self._publish(pi_id, True, now, summary)
+
+    def _expire_loop(self):
+        while True:
+            expired = []
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+                now = time.time()
+                while self._heap and self._heap[0][0] <= now:
+                    _, pi_id = heapq.heappop(self._heap)
+                    deadline = self._last_seen[pi_id] + self._timeout
+                    if deadline > now:
+                        # Heartbeats arrived since this entry was pushed
+                        self._scheduled[pi_id] = deadline
+                        heapq.heappush(self._heap, (deadline, pi_id))
+                        continue
+                    del self._scheduled[pi_id]
+                    self._live.discard(pi_id)
+                    self.version += 1
+                    expired.append((pi_id, self._last_seen[pi_id]))
+                summary = self._summary() if expired and not self._live else None
+                if not expired:
+                    self._cond.wait(timeout=self._heap[0][0] - now if self._heap else None)
+            for pi_id, last_seen in expired:
+                self._publish(pi_id, False, last_seen, None)
+            if summary:
+                self._publish(None, False, None, summary)
+
+    def _publish(self, pi_id, is_live, last_seen, summary):
+        """Push a device transition and/or a fleet summary to dashboards"""
+        if not SOCKETIO_AVAILABLE:
+            return
+        try:
+            if pi_id is not None:
+                socketio.emit('pi_device_status', {'pi_id': pi_id, 'is_live': is_live, 'last_heartbeat': last_seen},
+                              to='dashboard')
+            if summary:
+                socketio.emit('pi_status', summary, to='dashboard')
+        except Exception as e:
+            print(f"Pi status push error: {e}")
+
+    def _summary(self):
+        """Fleet view (caller holds the lock)"""
+        return {
+            'is_live': bool(self._live),
+            'last_heartbeat': self._latest,
+            'live_count': len(self._live),
+            'device_count': len(self._last_seen)
+        }
+
+    def summary(self):
+        with self._cond:
+            return self._summary()
+
+    def devices(self):
+        """pi_id -> {'is_live', 'last_heartbeat'}"""
+        with self._cond:
+            return {pi_id: {'is_live': pi_id in self._live, 'last_heartbeat': last_seen}
+                    for pi_id, last_seen in self._last_seen.items()}
+
+pi_heartbeats = PiHeartbeats(PI_LIVE_TIMEOUT)
+
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
@@ -1200,12 +3184,16 @@ def get_etrikes():
 
 @app.route('/get-filtered-data')
 @login_required
+@versioned_response(time_bucket=60)
 def get_filtered_data_route():
     """Get filtered passenger data based on selection"""
     toda_id = request.args.get('toda_id') or None
     etrike_id = request.args.get('etrike_id') or None
     pi_id = request.args.get('pi_id') or None
+    return jsonify(_filtered_data_payload(toda_id=toda_id, etrike_id=etrike_id, pi_id=pi_id))
 
+def _filtered_data_payload(toda_id=None, etrike_id=None, pi_id=None):
+    """Filtered passenger sessions for the last 7 days, ingest first with log fallback"""
     data = None
     source = 'logs'  # Default source
     
@@ -1219,11 +3207,11 @@ def get_filtered_data_route():
         data = get_filtered_data(toda_id=toda_id, etrike_id=etrike_id, pi_id=pi_id)
         source = 'logs'
 
-    return jsonify({
+    return {
         'total': len(data),
         'filtered_data': data,
         'source': source
-    })
+    }
 
 
 def get_filtered_data(toda_id=None, etrike_id=None, pi_id=None):
@@ -1257,8 +3245,69 @@ def get_filtered_data(toda_id=None, etrike_id=None, pi_id=None):
 
 @app.route('/data')
 @login_required
+@versioned_response(time_bucket=60)
 def data():
-    return jsonify(get_passenger_counts())
+    # ?exact=1 skips the sketches and counts distinct passengers exactly (audits)
+    exact = request.args.get('exact', '').lower() in ('1', 'true')
+    return jsonify(get_passenger_counts(exact=exact))
+
+@app.route('/unique-passengers')
+@login_required
+def unique_passengers():
+    """Unique passengers for a day, week or month, optionally filtered by TODA or Pi device"""
+    date_str = request.args.get('date')
+    period = request.args.get('period', 'daily')
+    toda_id = request.args.get('toda_id') or None
+    pi_id = request.args.get('pi_id') or None
+    exact = request.args.get('exact', '').lower() in ('1', 'true')
+    
+    if not date_str:
+        return jsonify({'error': 'Date parameter required'}), 400
+    if not USE_INGEST:
+        return jsonify({'error': 'Unique passenger counts require the ingest database'}), 400
+    
+    try:
+        if period == 'monthly' and len(date_str) == 7:  # "2025-09"
+            selected_date = datetime.datetime.strptime(date_str, '%Y-%m').date()
+        else:
+            selected_date = datetime.datetime.strptime(date_str, '%Y-%m-%d').date()
+    except ValueError:
+        return jsonify({'error': 'Invalid date format'}), 400
+    
+    if period == 'daily':
+        start_date = end_date = selected_date
+    elif period == 'weekly':
+        start_date = selected_date - datetime.timedelta(days=selected_date.weekday())
+        end_date = start_date + datetime.timedelta(days=6)
+    elif period == 'monthly':
+        start_date = selected_date.replace(day=1)
+        if start_date.month == 12:
+            end_date = start_date.replace(year=start_date.year + 1, month=1) - datetime.timedelta(days=1)
+        else:
+            end_date = start_date.replace(month=start_date.month + 1) - datetime.timedelta(days=1)
+    else:
+        return jsonify({'error': 'Invalid period'}), 400
+    
+    try:
+        conn = _events_db_conn()
+        total = count_unique_passengers(
+            conn,
+            datetime.datetime.combine(start_date, datetime.time.min).timestamp(),
+            datetime.datetime.combine(end_date, datetime.time.max).timestamp(),
+            device_id=pi_id, toda_id=toda_id, exact=exact
+        )
+        conn.close()
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    
+    return jsonify({
+        'date': date_str,
+        'period': period,
+        'toda_id': toda_id,
+        'pi_id': pi_id,
+        'unique_passengers': total,
+        'exact': exact
+    })
 
 @app.route("/ingest", methods=["POST"])
 def ingest():
@@ -1278,34 +3327,24 @@ def ingest():
             for e in events:
                 print("  Event:", e)
 
-        # Store in both events (for debugging) and sessions (for dashboard)
-        try:
-            conn = _events_db_conn()  # This will create tables if needed
-            
-            for event in events:
-                # Store in events table (debugging/audit trail)
-                event_id = event.get("event_id")
-                seq = event.get("seq", 0)
-                event_time_utc = time.time()
-                payload_json = json.dumps(event)
-                
-                conn.execute("""
-                    INSERT OR IGNORE INTO events (device_id, seq, event_id, event_time_utc, payload_json)
-                    VALUES (?, ?, ?, ?, ?)
-                """, (device_id, seq, event_id, event_time_utc, payload_json))
-                
-                # Extract session data from event
-                session_data = _extract_session_from_event(event, device_id)
-                if session_data:
-                    _upsert_session(conn, session_data)
-            
-            conn.commit()
-            conn.close()
-            print(f"[INGEST] Processed {len(events)} events into sessions")
+        # Store in both events (for debugging) and sessions (for dashboard).
+        # Only ack once the writer thread has committed the events.
+        if events:
+            try:
+                future = submit_ingest(device_id, events)
+            except queue.Full:
+                print(f"[INGEST] Write queue full, rejecting {len(events)} events from {device_id}")
+                return jsonify({"error": "ingest queue full, retry later"}), 503
             
-        except Exception as db_error:
-            print(f"[INGEST] Database error: {db_error}")
+            try:
+                written, duplicates = future.result(timeout=INGEST_ACK_TIMEOUT)
+            except Exception as db_error:
+                print(f"[INGEST] Database error: {db_error!r}")
+                return jsonify({"error": "events not stored, retry later"}), 503
+            print(f"[INGEST] Processed {written} events into sessions ({duplicates} duplicates skipped)")
 
+        pi_heartbeats.touch(device_id)
+        
         # Return ack response
         ack_seq = max([e.get("seq", 0) for e in events], default=since_seq or 0)
         return jsonify({"ack_seq": ack_seq})
@@ -1318,14 +3357,15 @@ def _extract_session_from_event(event, device_id):
     """Extract session data from an event payload"""
     try:
         # Handle nested payload_json structure
-        payload = event
-        if "payload_json" in event:
-            nested = event["payload_json"]
-            if isinstance(nested, str):
-                payload = json.loads(nested)
-            else:
-                payload = nested
-        
+        payload = _event_payload(event)
+    except Exception as e:
+        print(f"Error extracting session from event: {e}")
+        return None
+    return _extract_session_from_payload(payload, device_id)
+
+def _extract_session_from_payload(payload, device_id):
+    """Extract session data from an already decoded Pi payload"""
+    try:
         # Extract session fields
         person_id = payload.get("person_id")
         entry_timestamp = payload.get("entry_timestamp")
@@ -1363,53 +3403,251 @@ def _extract_session_from_event(event, device_id):
         print(f"Error extracting session from event: {e}")
         return None
 
-def _upsert_session(conn, session_data):
-    """UPSERT session data - merge entry/exit data idempotently"""
+# Merge a session row in SQL: keep the earliest entry and the latest exit
+_SESSION_UPSERT_SQL = """
+    INSERT INTO sessions (
+        device_id, session_id, person_id, entry_timestamp, exit_timestamp,
+        dwell_seconds, toda_id, etrike_id, city, pi_id, created_at, updated_at
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(device_id, session_id) DO UPDATE SET
+        entry_timestamp = MIN(COALESCE(sessions.entry_timestamp, excluded.entry_timestamp),
+                              COALESCE(excluded.entry_timestamp, sessions.entry_timestamp)),
+        exit_timestamp = MAX(COALESCE(sessions.exit_timestamp, excluded.exit_timestamp),
+                             COALESCE(excluded.exit_timestamp, sessions.exit_timestamp)),
+        dwell_seconds = CAST(
+            MAX(COALESCE(sessions.exit_timestamp, excluded.exit_timestamp),
+                COALESCE(excluded.exit_timestamp, sessions.exit_timestamp))
+            - MIN(COALESCE(sessions.entry_timestamp, excluded.entry_timestamp),
+                  COALESCE(excluded.entry_timestamp, sessions.entry_timestamp))
+            AS INTEGER),
+        toda_id = COALESCE(sessions.toda_id, excluded.toda_id),
+        etrike_id = COALESCE(sessions.etrike_id, excluded.etrike_id),
+        city = COALESCE(sessions.city, excluded.city),
+        updated_at = excluded.updated_at
+"""
+
+def _upsert_sessions(conn, sessions):
+    """UPSERT a batch of sessions - merge entry/exit data idempotently"""
+    if not sessions:
+        return
+    now = time.time()
+    conn.executemany(_SESSION_UPSERT_SQL, [
+        (
+            s["device_id"], s["session_id"], s["person_id"],
+            s["entry_timestamp"], s["exit_timestamp"], s["dwell_seconds"],
+            s["toda_id"], s["etrike_id"], s["city"], s["pi_id"],
+            now, now
+        )
+        for s in sessions
+    ])
+
+def _merged_sessions(conn, sessions):
+    """The stored rows of just-upserted sessions, once per session"""
+    merged = []
+    for key in dict.fromkeys((s["device_id"], s["session_id"]) for s in sessions):
+        row = conn.execute("""
+            SELECT device_id, session_id, person_id, entry_timestamp, exit_timestamp,
+                   dwell_seconds, toda_id, etrike_id, city, pi_id
+            FROM sessions WHERE device_id = ? AND session_id = ?
+        """, key).fetchone()
+        if row:
+            merged.append(dict(row))
+    return merged
+
+def _existing_event_ids(conn, event_ids):
+    """Return the subset of event_ids already stored in the events table"""
+    existing = set()
+    event_ids = list(event_ids)
+    # Stay well below SQLite's bound-parameter limit
+    for i in range(0, len(event_ids), 500):
+        chunk = event_ids[i:i + 500]
+        placeholders = ",".join("?" * len(chunk))
+        rows = conn.execute(f"SELECT event_id FROM events WHERE event_id IN ({placeholders})", chunk)
+        existing.update(row[0] for row in rows)
+    return existing
+
+def _write_ingest_events(conn, device_id, events):
+    """
+    Write a batch of events and their sessions inside the caller's transaction.
+    Events whose event_id is already stored (Pi retries) are skipped entirely.
+    Returns (events_written, duplicates_skipped, sessions).
+    """
+    event_time_utc = time.time()
+    seen_ids = _existing_event_ids(conn, {e.get("event_id") for e in events if e.get("event_id")})
+    fresh_events = []
+    for event in events:
+        event_id = event.get("event_id")
+        if event_id:
+            if event_id in seen_ids:
+                continue
+            seen_ids.add(event_id)
+        fresh_events.append(event)
+    
+    # Decode each nested payload exactly once
+    payloads = []
+    for event in fresh_events:
+        try:
+            payload = _event_payload(event)
+        except (ValueError, TypeError) as e:
+            print(f"Error decoding event payload: {e}")
+            payload = {}
+        payloads.append(payload if isinstance(payload, dict) else {})
+    
+    # Store in events table (debugging/audit trail)
+    conn.executemany("""
+        INSERT OR IGNORE INTO events (
+            device_id, seq, event_id, event_time_utc, payload_json,
+            person_id, entry_timestamp, exit_timestamp, toda_id, etrike_id, kind
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, [
+        (device_id, e.get("seq", 0), e.get("event_id"), event_time_utc, json.dumps(e))
+        + _event_payload_fields(p)
+        for e, p in zip(fresh_events, payloads)
+    ])
+    
+    sessions = [_extract_session_from_payload(p, device_id) for p in payloads]
+    sessions = [s for s in sessions if s]
+    _upsert_sessions(conn, sessions)
+    # Sketch (and count) the merged rows: a later event may have filled in the TODA
+    sessions = _merged_sessions(conn, sessions)
+    _update_passenger_sketches(conn, sessions)
+    
+    return len(fresh_events), len(events) - len(fresh_events), sessions
+
+def _write_ingest_batch(conn, write):
+    """Run one queued write in its own transaction"""
+    conn.execute("BEGIN IMMEDIATE")
     try:
-        # First, try to get existing session
-        existing = conn.execute("""
-            SELECT entry_timestamp, exit_timestamp, dwell_seconds 
-            FROM sessions 
-            WHERE device_id = ? AND session_id = ?
-        """, (session_data["device_id"], session_data["session_id"])).fetchone()
+        result = write(conn)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return result
+
+# ============================================================================
+# INGEST WRITER - single writer thread with group commit
+# ============================================================================
+
+# Pending (write, size, future) tuples waiting for the writer thread. write(conn)
+# runs inside the group's transaction and returns (written, sessions, result):
+# written/sessions feed _after_ingest_commit, result resolves the future.
+_ingest_queue = queue.Queue(maxsize=INGEST_QUEUE_MAX)
+_ingest_writer_thread = None
+_ingest_writer_lock = threading.Lock()
+
+def _ingest_write(device_id, events):
+    """Queued write for a device's events"""
+    def write(conn):
+        written, duplicates, sessions = _write_ingest_events(conn, device_id, events)
+        return written, sessions, (written, duplicates)
+    return write
+
+def _submit_write(write, size, block=False):
+    """Queue a write for the writer thread; returns its Future"""
+    _ensure_ingest_writer()
+    future = concurrent.futures.Future()
+    item = (write, size, future)
+    if block:
+        _ingest_queue.put(item)
+    else:
+        _ingest_queue.put_nowait(item)
+    return future
+
+def submit_ingest(device_id, events):
+    """
+    Queue events for the writer thread. Returns a Future that resolves to
+    (events_written, duplicates_skipped) once the events are committed.
+    Raises queue.Full when the writer is too far behind.
+    """
+    return _submit_write(_ingest_write(device_id, events), len(events))
+
+def _ensure_ingest_writer():
+    """Start the writer thread if it is not running"""
+    global _ingest_writer_thread
+    with _ingest_writer_lock:
+        if _ingest_writer_thread is None or not _ingest_writer_thread.is_alive():
+            _ingest_writer_thread = threading.Thread(target=_ingest_writer_loop, daemon=True)
+            _ingest_writer_thread.start()
+            print("[INGEST] Writer thread started")
+
+def _ingest_writer_loop():
+    """Collect queued requests for up to INGEST_COMMIT_INTERVAL_MS and commit them together"""
+    conn = None
+    while True:
+        group = [_ingest_queue.get()]
+        event_count = group[0][1]
+        deadline = time.monotonic() + INGEST_COMMIT_INTERVAL_MS / 1000.0
+        while event_count < INGEST_COMMIT_MAX_EVENTS:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = _ingest_queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            group.append(item)
+            event_count += item[1]
         
-        if existing:
-            # Update existing session - keep earliest entry, update exit if provided
-            entry_ts = existing["entry_timestamp"] or session_data["entry_timestamp"]
-            exit_ts = session_data["exit_timestamp"] or existing["exit_timestamp"]
-            
-            # Recalculate dwell time
-            dwell_seconds = None
-            if exit_ts and entry_ts:
-                dwell_seconds = int(exit_ts - entry_ts)
-            
-            conn.execute("""
-                UPDATE sessions SET
-                    entry_timestamp = ?,
-                    exit_timestamp = ?,
-                    dwell_seconds = ?,
-                    updated_at = ?
-                WHERE device_id = ? AND session_id = ?
-            """, (entry_ts, exit_ts, dwell_seconds, time.time(),
-                  session_data["device_id"], session_data["session_id"]))
-        else:
-            # Insert new session
-            now = time.time()
-            conn.execute("""
-                INSERT INTO sessions (
-                    device_id, session_id, person_id, entry_timestamp, exit_timestamp,
-                    dwell_seconds, toda_id, etrike_id, city, pi_id, created_at, updated_at
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                session_data["device_id"], session_data["session_id"], session_data["person_id"],
-                session_data["entry_timestamp"], session_data["exit_timestamp"], session_data["dwell_seconds"],
-                session_data["toda_id"], session_data["etrike_id"], session_data["city"], session_data["pi_id"],
-                now, now
-            ))
-            
+        try:
+            if conn is None:
+                # Dedicated connection: acks promise durability, and group commit
+                # makes a full fsync per commit affordable
+                init_events_db()
+                conn = _open_events_db_conn()
+                conn.execute("PRAGMA synchronous=FULL")
+            _commit_ingest_group(conn, group)
+        except Exception as e:
+            print(f"[INGEST] Writer error: {e}")
+            for _, _, future in group:
+                if not future.done():
+                    future.set_exception(e)
+            if conn is not None:
+                conn.close_for_real()
+                conn = None
+
+def _commit_ingest_group(conn, group):
+    """Commit a group of requests in one transaction, isolating failures per request"""
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        results = [write(conn) for write, _, _ in group]
+        conn.commit()
     except Exception as e:
-        print(f"Error upserting session: {e}")
-        raise
+        conn.rollback()
+        if len(group) == 1:
+            group[0][2].set_exception(e)
+            return
+        print(f"[INGEST] Group commit of {len(group)} requests failed, retrying one by one: {e}")
+        for write, _, future in group:
+            try:
+                written, sessions, result = _write_ingest_batch(conn, write)
+            except Exception as request_error:
+                future.set_exception(request_error)
+                continue
+            _after_ingest_commit(written, sessions)
+            future.set_result(result)
+        return
+    
+    _after_ingest_commit(
+        sum(written for written, _, _ in results),
+        [s for _, sessions, _ in results for s in sessions]
+    )
+    for (_, _, future), (_, _, result) in zip(group, results):
+        future.set_result(result)
+
+def _after_ingest_commit(written, sessions):
+    """Update in-memory state and notify dashboards once ingested events are committed"""
+    if not written:
+        return
+    bump_data_version()
+    try:
+        live_counters.add_sessions(sessions)
+    except Exception as e:
+        print(f"[INGEST] Live counter update failed: {e}")
+    for session in sessions:
+        gps_store.set_labels(session.get('pi_id'), city=session.get('city'),
+                             toda_id=session.get('toda_id'), etrike_id=session.get('etrike_id'))
+    schedule_dashboard_push(sessions)
 
 @app.route("/health")
 def health():
@@ -1426,8 +3664,11 @@ def health():
             "ingest": {
                 "USE_INGEST": USE_INGEST,
                 "EVENTS_DB_PATH": EVENTS_DB_PATH,
-                "events_db_exists": os.path.exists(EVENTS_DB_PATH)
-            }
+                "events_db_exists": os.path.exists(EVENTS_DB_PATH),
+                "write_queue_depth": _ingest_queue.qsize()
+            },
+            "log_cache": log_cache_stats(),
+            "gps_broadcast": gps_broadcaster.stats()
         }, 200
     except Exception as e:
         return {"status": "error", "message": str(e)}, 500
@@ -1503,8 +3744,7 @@ def ingest_debug():
 @app.route("/ingest/health")
 def ingest_health():
     try:
-        # Open DB (read-only style)
-        conn = sqlite3.connect(EVENTS_DB_PATH)
+        conn = _events_db_conn()
         cur = conn.cursor()
 
         # Total rows + most recent event time
@@ -1537,172 +3777,227 @@ def ingest_health():
 
 @app.route('/pi-heartbeat', methods=['POST'])
 def pi_heartbeat():
-    """Pi device heartbeat to maintain connection status"""
-    global last_pi_heartbeat_time
-    last_pi_heartbeat_time = datetime.datetime.now().timestamp()
+    """
+    Pi device heartbeat to maintain connection status. Devices should send
+    pi_id (JSON body, query or X-Pi-Id header); heartbeats without one are
+    tracked as the single device 'unknown' so older Pis still show as live.
+    """
+    data = request.get_json(silent=True) or {}
+    pi_id = data.get('pi_id') or request.args.get('pi_id') or request.headers.get('X-Pi-Id')
+    pi_heartbeats.touch(pi_id)
     return jsonify({'status': 'ok'})
 
 @app.route('/pi-live-status')
 @login_required
+@versioned_response(validator=lambda: f"{pi_heartbeats.version}-{request.args.get('pi_id', '')}")
 def pi_live_status():
-    """Check if Pi devices are connected (heartbeat within last 15 seconds)"""
-    global last_pi_heartbeat_time
-    current_time = datetime.datetime.now().timestamp()
-    
-    # Consider live if Pi devices sent heartbeat recently
-    is_live = (current_time - last_pi_heartbeat_time) <= 15  # 15 seconds threshold
-    
-    return jsonify({'is_live': is_live, 'last_heartbeat': last_pi_heartbeat_time})
+    """
+    Fleet liveness plus per-device status (optionally one pi_id). The ETag only
+    changes on live/stale transitions, so last_heartbeat in a revalidated body may lag.
+    """
+    status = pi_heartbeats.summary()
+    devices = pi_heartbeats.devices()
+    pi_id = request.args.get('pi_id')
+    if pi_id:
+        device = devices.get(pi_id, {'is_live': False, 'last_heartbeat': 0})
+        return jsonify({'pi_id': pi_id, **device})
+    status['devices'] = devices
+    return jsonify(status)
+
+def _validate_gps_fixes(records):
+    """
+    Check and normalise raw fixes in one pass.
+    Returns (fixes, rejected) where rejected is [{'index', 'error'}].
+    """
+    required_fields = ['pi_id', 'latitude', 'longitude', 'timestamp']
+    received_at = datetime.datetime.now().isoformat()
+    fixes = []
+    rejected = []
+    for index, data in enumerate(records):
+        if not isinstance(data, dict):
+            rejected.append({'index': index, 'error': 'Fix must be an object'})
+            continue
+        missing = [field for field in required_fields if field not in data]
+        if missing:
+            rejected.append({'index': index, 'error': f'Missing required field: {missing[0]}'})
+            continue
+        try:
+            fix = {
+                'pi_id': data['pi_id'],
+                'latitude': float(data['latitude']),
+                'longitude': float(data['longitude']),
+                'speed': float(data.get('speed', 0)),
+                'heading': float(data.get('heading', 0)),
+                'timestamp': data['timestamp'],
+                'received_at': received_at
+            }
+        except (TypeError, ValueError) as e:
+            rejected.append({'index': index, 'error': f'Invalid number: {e}'})
+            continue
+        if not (-90 <= fix['latitude'] <= 90 and -180 <= fix['longitude'] <= 180):
+            rejected.append({'index': index, 'error': 'Coordinates out of range'})
+            continue
+        fixes.append((fix, data))
+    return fixes, rejected
 
 @app.route('/gps-data', methods=['POST'])
 def receive_gps_data():
-    """Receive GPS data from Pi devices"""
+    """
+    Receive GPS data from Pi devices: one fix, a JSON array of fixes, or an
+    NDJSON stream (one fix per line) when replaying after an outage.
+    """
     try:
-        data = request.get_json()
+        try:
+            records = []
+            for record in iter_json_records(request.stream):
+                records.append(record)
+                if len(records) > GPS_BATCH_MAX_FIXES:
+                    return jsonify({'error': f'At most {GPS_BATCH_MAX_FIXES} fixes per request'}), 413
+        except (json.JSONDecodeError, UnicodeDecodeError) as e:
+            return jsonify({'error': f'Invalid JSON: {e}'}), 400
         
-        # Validate required fields
-        required_fields = ['pi_id', 'latitude', 'longitude', 'timestamp']
-        for field in required_fields:
-            if field not in data:
-                return jsonify({'error': f'Missing required field: {field}'}), 400
-        
-        # Store GPS data
-        gps_entry = {
-            'pi_id': data['pi_id'],
-            'latitude': float(data['latitude']),
-            'longitude': float(data['longitude']),
-            'speed': float(data.get('speed', 0)),
-            'heading': float(data.get('heading', 0)),
-            'timestamp': data['timestamp'],
-            'received_at': datetime.datetime.now().isoformat()
-        }
+        fixes, rejected = _validate_gps_fixes(records)
+        if not fixes:
+            error = rejected[0]['error'] if rejected else 'No GPS fixes in request'
+            return jsonify({'error': error, 'rejected': rejected}), 400
         
-        # Save to both current GPS log (for real-time display) and daily historical log
-        save_gps_data_to_files(gps_entry)
+        # Apply in time order per device so the latest position and tracks stay consistent
+        by_pi = defaultdict(list)
+        for fix, data in fixes:
+            by_pi[fix['pi_id']].append((fix, data))
+        acks = {}
+        for pi_id, items in by_pi.items():
+            items.sort(key=lambda item: _fix_timestamp(item[0]))
+            pi_fixes = [fix for fix, _ in items]
+            
+            # Keep in memory for real-time display; persisted by the snapshot thread
+            skipped = gps_store.add_many(pi_fixes)
+            submit_track_fixes(pi_id, pi_fixes)
+            last = items[-1][1]
+            gps_store.set_labels(pi_id, city=last.get('city'), toda_id=last.get('toda_id'),
+                                 etrike_id=last.get('etrike_id'))
+            # skipped fixes are stored in the track but were older than the live position
+            acks[pi_id] = {'accepted': len(pi_fixes), 'skipped': skipped,
+                           'last_timestamp': pi_fixes[-1]['timestamp']}
+        bump_data_version()
         
-        # Update Pi heartbeat
-        global last_pi_heartbeat_time
-        last_pi_heartbeat_time = datetime.datetime.now().timestamp()
+        # Update Pi heartbeats
+        for pi_id in by_pi:
+            pi_heartbeats.touch(pi_id)
         
-        return jsonify({'status': 'success', 'message': 'GPS data received'})
+        if len(records) > 1:
+            print(f"📍 GPS batch: {len(fixes)} fixes accepted, {len(rejected)} rejected")
+        return jsonify({
+            'status': 'success',
+            'message': 'GPS data received',
+            'batch_id': request.args.get('batch_id') or request.headers.get('X-Batch-Id'),
+            'accepted': len(fixes),
+            'rejected': rejected,
+            'devices': acks
+        })
         
     except Exception as e:
         print(f"GPS data error: {e}")
         return jsonify({'error': str(e)}), 500
 
-def save_gps_data_to_files(gps_entry):
-    """Save GPS data to current log file for real-time display"""
-    # Ensure logs directory exists
-    os.makedirs(LOG_DIR, exist_ok=True)
-    
-    # Save to current GPS log file (for real-time display)
-    gps_log_path = os.path.join(LOG_DIR, 'gps_data.json')
-    gps_data = []
-    
-    if os.path.exists(gps_log_path):
-        try:
-            with open(gps_log_path, 'r') as f:
-                gps_data = json.load(f)
-        except (json.JSONDecodeError, FileNotFoundError):
-            gps_data = []
-    
-    gps_data.append(gps_entry)
-    
-    # Keep only last 1000 entries to prevent file from growing too large
-    if len(gps_data) > 1000:
-        gps_data = gps_data[-1000:]
-    
-    with open(gps_log_path, 'w') as f:
-        json.dump(gps_data, f, indent=2)
+def _parse_track_time(value, default):
+    """Epoch seconds from a query value given as epoch or ISO datetime"""
+    if not value:
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.datetime.fromisoformat(value).timestamp()
 
-@app.route('/vehicle-locations')
+@app.route('/vehicle-track')
 @login_required
-def get_vehicle_locations():
-    """Get current vehicle locations for map display"""
+def vehicle_track():
+    """One device's track between from/to (default: today), simplified for the map zoom"""
+    pi_id = request.args.get('pi_id')
+    if not pi_id:
+        return jsonify({'error': 'pi_id is required'}), 400
     try:
-        gps_log_path = os.path.join(LOG_DIR, 'gps_data.json')
-        if not os.path.exists(gps_log_path):
-            return jsonify({'vehicles': []})
-        
-        with open(gps_log_path, 'r') as f:
-            gps_data = json.load(f)
-        
-        # Get latest location for each Pi device
-        latest_locations = {}
-        for entry in gps_data:
-            pi_id = entry['pi_id']
-            entry_time = datetime.datetime.fromisoformat(entry['received_at'])
-            
-            if pi_id not in latest_locations or entry_time > datetime.datetime.fromisoformat(latest_locations[pi_id]['received_at']):
-                latest_locations[pi_id] = entry
-        
-        # Convert to vehicle format
-        vehicles = []
-        
-        for pi_id, location in latest_locations.items():
-            # Check if vehicle is offline (no data for 5 minutes)
-            # Use Pi's timestamp for offline detection to avoid timezone issues
-            pi_timestamp = location.get('timestamp', 0)
-            if pi_timestamp:
-                # Convert UTC timestamp to CET timezone
-                import pytz
-                utc_time = datetime.datetime.fromtimestamp(pi_timestamp, tz=pytz.UTC)
-                last_update = utc_time.astimezone(pytz.timezone('Europe/Madrid'))
-                time_since_update = (datetime.datetime.now(pytz.timezone('Europe/Madrid')) - last_update).total_seconds()
-            else:
-                # Fallback to received_at if no Pi timestamp
-                last_update = datetime.datetime.fromisoformat(location['received_at'])
-                time_since_update = (datetime.datetime.now() - last_update).total_seconds()
-            
-            is_offline = time_since_update > 300  # 5 minutes = 300 seconds
-            
-            # Check if vehicle is parked (stationary for 10+ minutes)
-            # We'll determine this by checking if the last position is the same as current
-            # For now, we'll use a simple heuristic: if speed is 0 and not offline, consider it parked
-            is_parked = False
-            if not is_offline and location.get('speed', 0) == 0:
-                # Check if we have previous position data to compare
-                # This is a simplified check - in a real system you'd compare coordinates
-                is_parked = time_since_update > 600  # 10 minutes = 600 seconds
-            
-            # Determine status
-            if is_offline:
-                status = 'offline'
-            elif is_parked:
-                status = 'parked'
-            else:
-                status = 'online'
-            
-            # Use the same timestamp for display
-            if pi_timestamp:
-                last_update_str = last_update.isoformat()
-            else:
-                last_update_str = location['received_at']
-            
-            vehicle = {
-                'id': f'pi-{pi_id}',
-                'name': f"Pi Device {pi_id}",
-                'lat': location['latitude'],
-                'lng': location['longitude'],
-                'speed': location.get('speed', 0),
-                'heading': location.get('heading', 0),
-                'status': status,
-                'passengers': 0,  # This would come from passenger data
-                'toda': '',
-                'pi': pi_id,
-                'last_update': last_update_str
-            }
-            vehicles.append(vehicle)
-        
-        return jsonify({'vehicles': vehicles})
-        
+        midnight = datetime.datetime.combine(datetime.date.today(), datetime.time()).timestamp()
+        start_ts = _parse_track_time(request.args.get('from'), midnight)
+        end_ts = _parse_track_time(request.args.get('to'), time.time())
+        zoom = float(request.args.get('zoom', 16))
+    except ValueError as e:
+        return jsonify({'error': f'Invalid parameter: {e}'}), 400
+    if end_ts < start_ts:
+        return jsonify({'error': 'from must be before to'}), 400
+    if end_ts - start_ts > GPS_TRACK_MAX_DAYS * 86400:
+        return jsonify({'error': f'Range is limited to {GPS_TRACK_MAX_DAYS} days'}), 400
+    
+    try:
+        records = read_track(pi_id, start_ts, end_ts)
+        tolerance = 0.0
+        if records:
+            # Equirectangular projection around the track's first fix is plenty at city scale
+            lat0 = records[0][1]
+            kx = 111320.0 * math.cos(math.radians(lat0))
+            points = [(r[2] * kx, r[1] * 110540.0) for r in records]
+            tolerance = track_tolerance_metres(zoom, lat0)
+            kept = [records[i] for i in simplify_track(points, tolerance)]
+        else:
+            kept = []
+        return jsonify({
+            'pi_id': pi_id,
+            'from': start_ts,
+            'to': end_ts,
+            'tolerance_m': round(tolerance, 2),
+            'raw_points': len(records),
+            # [lat, lng, timestamp, speed] keeps the payload compact
+            'points': [[round(r[1], 6), round(r[2], 6), r[0], round(r[3], 1)] for r in kept]
+        })
     except Exception as e:
-        print(f"Vehicle locations error: {e}")
-        return jsonify({'vehicles': []})
+        print(f"Vehicle track error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/vehicle-locations')
+@login_required
+def get_vehicle_locations():
+    """
+    Get current vehicle locations for map display. With bbox=west,south,east,north
+    only vehicles in view are returned; with zoom <= GPS_CLUSTER_MAX_ZOOM nearby
+    vehicles come back as clusters instead. city/toda_id narrow the result to the
+    same vehicles as the matching GPS socket room.
+    """
+    city = request.args.get('city') or None
+    toda_id = request.args.get('toda_id') or None
+    only = gps_store.labelled(city, toda_id) if city or toda_id else None
+    bbox = request.args.get('bbox')
+    if not bbox:
+        if only is not None:
+            return jsonify({'vehicles': get_vehicle_locations_data(sorted(only))})
+        return jsonify({'vehicles': get_vehicle_locations_data()})
+    try:
+        west, south, east, north = (float(v) for v in bbox.split(','))
+        zoom = request.args.get('zoom', type=float)
+    except ValueError:
+        return jsonify({'error': 'bbox must be west,south,east,north'}), 400
+    if west > east or south > north:
+        return jsonify({'error': 'bbox must be west,south,east,north'}), 400
+    
+    if zoom is None or zoom > GPS_CLUSTER_MAX_ZOOM:
+        in_view = gps_store.in_bbox(west, south, east, north)
+        if only is not None:
+            in_view = [pi_id for pi_id in in_view if pi_id in only]
+        return jsonify({'vehicles': get_vehicle_locations_data(in_view), 'clusters': []})
+    
+    cell_deg = 360.0 / (2 ** zoom) * GPS_CLUSTER_CELL_PX / 256
+    singles = []
+    clusters = []
+    for count, lat, lng, pi_ids in gps_store.clusters(west, south, east, north, cell_deg, only):
+        if count == 1:
+            singles.extend(pi_ids)
+        else:
+            clusters.append({'lat': round(lat, 6), 'lng': round(lng, 6), 'count': count})
+    return jsonify({'vehicles': get_vehicle_locations_data(singles), 'clusters': clusters})
 
 
 @app.route('/population-data')
 @login_required
+@versioned_response(time_bucket=60)
 def population_data():
     """Get 30-minute interval population data for the current day"""
     today = datetime.datetime.now()
@@ -1721,23 +4016,22 @@ def population_data():
     today_log_path = os.path.join(LOG_DIR, str(today.year), str(today.month), f"{today.day}.json")
     if os.path.exists(today_log_path):
         try:
-            with open(today_log_path, 'r') as f:
-                log_data = json.load(f)
+            log_data = read_log_file(today_log_path)
+            
+            # Count passengers by 30-minute intervals
+            for entry in log_data:
+                # Use Pi's local time directly (no timezone conversion)
+                entry_time = datetime.datetime.fromtimestamp(entry['entry_timestamp'])
+                hour = entry_time.hour
+                minute = entry_time.minute
+                
+                # Determine which 30-minute interval
+                interval_minute = 0 if minute < 30 else 30
+                interval_index = hour * 2 + (0 if minute < 30 else 1)
+                
+                if 0 <= interval_index < len(interval_data):
+                    interval_data[interval_index]['count'] += 1
                 
-                # Count passengers by 30-minute intervals
-                for entry in log_data:
-                    # Use Pi's local time directly (no timezone conversion)
-                    entry_time = datetime.datetime.fromtimestamp(entry['entry_timestamp'])
-                    hour = entry_time.hour
-                    minute = entry_time.minute
-                    
-                    # Determine which 30-minute interval
-                    interval_minute = 0 if minute < 30 else 30
-                    interval_index = hour * 2 + (0 if minute < 30 else 1)
-                    
-                    if 0 <= interval_index < len(interval_data):
-                        interval_data[interval_index]['count'] += 1
-                    
         except (json.JSONDecodeError, FileNotFoundError):
             pass
     
@@ -1771,42 +4065,24 @@ def get_historical_population_data_from_ingest(target_date):
         
         # Query events for the target date
         sql = """
-          SELECT payload_json
+          SELECT entry_timestamp
           FROM events
-          WHERE event_time_utc >= ? AND event_time_utc <= ?
-            AND json_extract(payload_json, '$.payload_json') LIKE '%"entry_timestamp"%'
-          ORDER BY seq ASC
+          WHERE entry_timestamp >= ? AND entry_timestamp <= ?
         """
         
         rows = conn.execute(sql, (start_epoch, end_epoch)).fetchall()
         
+        # Convert timestamp to local time
+        import pytz
+        local_tz = pytz.timezone('Europe/Madrid')
         for row in rows:
-            try:
-                payload = row["payload_json"]
-                if isinstance(payload, str):
-                    payload = json.loads(payload)
-                
-                # Handle nested payload structure
-                if "payload_json" in payload:
-                    nested_payload = payload["payload_json"]
-                    if isinstance(nested_payload, str):
-                        nested_payload = json.loads(nested_payload)
-                    
-                    if "entry_timestamp" in nested_payload:
-                        # Convert timestamp to local time
-                        import pytz
-                        utc_time = datetime.datetime.fromtimestamp(nested_payload['entry_timestamp'], tz=pytz.UTC)
-                        entry_time = utc_time.astimezone(pytz.timezone('Europe/Madrid'))
-                        hour = entry_time.hour
-                        minute = entry_time.minute
-                        
-                        # Determine which 30-minute interval
-                        interval_index = hour * 2 + (0 if minute < 30 else 1)
-                        
-                        if 0 <= interval_index < len(interval_data):
-                            interval_data[interval_index]['count'] += 1
-            except Exception as e:
-                continue
+            entry_time = datetime.datetime.fromtimestamp(row[0], tz=local_tz)
+            
+            # Determine which 30-minute interval
+            interval_index = entry_time.hour * 2 + (0 if entry_time.minute < 30 else 1)
+            
+            if 0 <= interval_index < len(interval_data):
+                interval_data[interval_index]['count'] += 1
         
         conn.close()
         return interval_data
@@ -1815,8 +4091,61 @@ def get_historical_population_data_from_ingest(target_date):
         print(f"Error getting historical population data from ingest: {e}")
         return None
 
+def get_population_data_for_date(target_date):
+    """30-minute interval population data for a date; returns (interval_data, source)"""
+    interval_data = None
+    source = 'logs'
+    
+    # Try ingest database first if enabled
+    if USE_INGEST:
+        interval_data = get_historical_population_data_from_ingest(target_date)
+        if interval_data is not None:
+            source = 'ingest'
+    
+    # Fallback to log files if ingest not available or no data
+    if interval_data is None:
+        interval_data = []
+        
+        # Initialize 48 intervals (every 30 minutes) with 0 counts
+        for hour in range(24):
+            for minute in [0, 30]:
+                interval_data.append({
+                    'hour': f"{hour:02d}:{minute:02d}",
+                    'count': 0,
+                    'timestamp': hour * 60 + minute
+                })
+        
+        # Get the specific date's log data
+        log_path = os.path.join(LOG_DIR, str(target_date.year), str(target_date.month), f"{target_date.day}.json")
+        if os.path.exists(log_path):
+            try:
+                log_data = read_log_file(log_path)
+                
+                # Count passengers by 30-minute intervals
+                for entry in log_data:
+                    # Convert UTC timestamp to CET timezone
+                    import pytz
+                    utc_time = datetime.datetime.fromtimestamp(entry['entry_timestamp'], tz=pytz.UTC)
+                    entry_time = utc_time.astimezone(pytz.timezone('Europe/Madrid'))
+                    hour = entry_time.hour
+                    minute = entry_time.minute
+                    
+                    # Determine which 30-minute interval
+                    interval_minute = 0 if minute < 30 else 30
+                    interval_index = hour * 2 + (0 if minute < 30 else 1)
+                    
+                    if 0 <= interval_index < len(interval_data):
+                        interval_data[interval_index]['count'] += 1
+                    
+            except (json.JSONDecodeError, FileNotFoundError):
+                pass
+        source = 'logs'
+    
+    return interval_data, source
+
 @app.route('/historical-population-data')
 @login_required
+@versioned_response()
 def historical_population_data():
     """Get historical 30-minute interval population data for a specific date"""
     date_str = request.args.get('date')
@@ -1825,54 +4154,7 @@ def historical_population_data():
     
     try:
         target_date = datetime.datetime.strptime(date_str, '%Y-%m-%d')
-        interval_data = None
-        source = 'logs'
-        
-        # Try ingest database first if enabled
-        if USE_INGEST:
-            interval_data = get_historical_population_data_from_ingest(target_date)
-            if interval_data is not None:
-                source = 'ingest'
-        
-        # Fallback to log files if ingest not available or no data
-        if interval_data is None:
-            interval_data = []
-            
-            # Initialize 48 intervals (every 30 minutes) with 0 counts
-            for hour in range(24):
-                for minute in [0, 30]:
-                    interval_data.append({
-                        'hour': f"{hour:02d}:{minute:02d}",
-                        'count': 0,
-                        'timestamp': hour * 60 + minute
-                    })
-            
-            # Get the specific date's log data
-            log_path = os.path.join(LOG_DIR, str(target_date.year), str(target_date.month), f"{target_date.day}.json")
-            if os.path.exists(log_path):
-                try:
-                    with open(log_path, 'r') as f:
-                        log_data = json.load(f)
-                        
-                        # Count passengers by 30-minute intervals
-                        for entry in log_data:
-                            # Convert UTC timestamp to CET timezone
-                            import pytz
-                            utc_time = datetime.datetime.fromtimestamp(entry['entry_timestamp'], tz=pytz.UTC)
-                            entry_time = utc_time.astimezone(pytz.timezone('Europe/Madrid'))
-                            hour = entry_time.hour
-                            minute = entry_time.minute
-                            
-                            # Determine which 30-minute interval
-                            interval_minute = 0 if minute < 30 else 30
-                            interval_index = hour * 2 + (0 if minute < 30 else 1)
-                            
-                            if 0 <= interval_index < len(interval_data):
-                                interval_data[interval_index]['count'] += 1
-                            
-                except (json.JSONDecodeError, FileNotFoundError):
-                    pass
-            source = 'logs'
+        interval_data, source = get_population_data_for_date(target_date)
         
         return jsonify({
             'date': date_str,
@@ -1904,21 +4186,10 @@ def get_historical_data_filtered_from_ingest(selected_date, period):
         
         if period == 'daily':
             # Get data for the specific day
-            start_of_day = datetime.datetime.combine(selected_date, datetime.time.min)
-            end_of_day = datetime.datetime.combine(selected_date, datetime.time.max)
-            start_epoch = start_of_day.timestamp()
-            end_epoch = end_of_day.timestamp()
-            
-            daily_sql = """
-              SELECT COUNT(*) as total
-              FROM events
-              WHERE event_time_utc >= ? AND event_time_utc <= ?
-                AND (json_extract(payload_json, '$.entry_timestamp') IS NOT NULL 
-                     OR json_extract(payload_json, '$.payload_json') LIKE '%"entry_timestamp"%')
-            """
+            start_epoch = datetime.datetime.combine(selected_date, datetime.time.min).timestamp()
+            end_epoch = datetime.datetime.combine(selected_date, datetime.time.max).timestamp()
             
-            row = conn.execute(daily_sql, (start_epoch, end_epoch)).fetchone()
-            daily_total = row["total"] if row else 0
+            daily_total = _rollup_completed_sessions(conn, start_epoch, end_epoch)
             
             if daily_total > 0:
                 result["daily"].append({
@@ -1933,16 +4204,7 @@ def get_historical_data_filtered_from_ingest(selected_date, period):
             start_epoch = datetime.datetime.combine(start_of_week, datetime.time.min).timestamp()
             end_epoch = datetime.datetime.combine(end_of_week, datetime.time.max).timestamp()
             
-            weekly_sql = """
-              SELECT COUNT(*) as total
-              FROM events
-              WHERE event_time_utc >= ? AND event_time_utc <= ?
-                AND (json_extract(payload_json, '$.entry_timestamp') IS NOT NULL 
-                     OR json_extract(payload_json, '$.payload_json') LIKE '%"entry_timestamp"%')
-            """
-            
-            row = conn.execute(weekly_sql, (start_epoch, end_epoch)).fetchone()
-            weekly_total = row["total"] if row else 0
+            weekly_total = _rollup_completed_sessions(conn, start_epoch, end_epoch)
             
             if weekly_total > 0:
                 result["weekly"].append({
@@ -1961,16 +4223,7 @@ def get_historical_data_filtered_from_ingest(selected_date, period):
             start_epoch = datetime.datetime.combine(start_of_month, datetime.time.min).timestamp()
             end_epoch = datetime.datetime.combine(end_of_month, datetime.time.max).timestamp()
             
-            monthly_sql = """
-              SELECT COUNT(*) as total
-              FROM events
-              WHERE event_time_utc >= ? AND event_time_utc <= ?
-                AND (json_extract(payload_json, '$.entry_timestamp') IS NOT NULL 
-                     OR json_extract(payload_json, '$.payload_json') LIKE '%"entry_timestamp"%')
-            """
-            
-            row = conn.execute(monthly_sql, (start_epoch, end_epoch)).fetchone()
-            monthly_total = row["total"] if row else 0
+            monthly_total = _rollup_completed_sessions(conn, start_epoch, end_epoch)
             
             if monthly_total > 0:
                 result["monthly"].append({
@@ -2019,68 +4272,54 @@ def historical_data_filtered():
                 source = 'ingest'
         
         # Fallback to log files if ingest not available or no data
-        if not result[period]:  # If no data found in ingest, try logs
+        if not result[period] and log_fallback_needed():  # If no data found in ingest, try logs
             source = 'logs'
             if period == 'daily':
                 # Get data for the specific day
                 log_path = os.path.join(LOG_DIR, str(selected_date.year), str(selected_date.month), f"{selected_date.day}.json")
                 if os.path.exists(log_path):
                     try:
-                        with open(log_path, 'r') as f:
-                            log_data = json.load(f)
-                            daily_total = len(log_data)
-                            if daily_total > 0:
-                                result["daily"].append({
-                                    "date": selected_date.strftime("%Y-%m-%d"),
-                                    "total": daily_total
-                                })
+                        log_data = read_log_file(log_path)
+                        daily_total = len(log_data)
+                        if daily_total > 0:
+                            result["daily"].append({
+                                "date": selected_date.strftime("%Y-%m-%d"),
+                                "total": daily_total
+                            })
                     except (json.JSONDecodeError, FileNotFoundError):
                         pass
                     
-        elif period == 'weekly':
-            # Get data for the week containing the selected date
-            start_of_week = selected_date - datetime.timedelta(days=selected_date.weekday())
-            weekly_total = 0
+            elif period == 'weekly':
+                # Get data for the week containing the selected date
+                start_of_week = selected_date - datetime.timedelta(days=selected_date.weekday())
+                weekly_total = 0
             
-            for i in range(7):
-                check_date = start_of_week + datetime.timedelta(days=i)
-                log_path = os.path.join(LOG_DIR, str(check_date.year), str(check_date.month), f"{check_date.day}.json")
-                if os.path.exists(log_path):
-                    try:
-                        with open(log_path, 'r') as f:
-                            log_data = json.load(f)
+                for i in range(7):
+                    check_date = start_of_week + datetime.timedelta(days=i)
+                    log_path = os.path.join(LOG_DIR, str(check_date.year), str(check_date.month), f"{check_date.day}.json")
+                    if os.path.exists(log_path):
+                        try:
+                            log_data = read_log_file(log_path)
                             weekly_total += len(log_data)
-                    except (json.JSONDecodeError, FileNotFoundError):
-                        continue
+                        except (json.JSONDecodeError, FileNotFoundError):
+                            continue
             
-            if weekly_total > 0:
-                result["weekly"].append({
-                    "week_of": start_of_week.strftime("%Y-%m-%d"),
-                    "total": weekly_total
-                })
+                if weekly_total > 0:
+                    result["weekly"].append({
+                        "week_of": start_of_week.strftime("%Y-%m-%d"),
+                        "total": weekly_total
+                    })
                 
-        elif period == 'monthly':
-            # Get data for the month containing the selected date
-            month_start = selected_date.replace(day=1)
-            month_total = 0
-            current_day = month_start
-            
-            while current_day.month == month_start.month and current_day.year == month_start.year:
-                log_path = os.path.join(LOG_DIR, str(current_day.year), str(current_day.month), f"{current_day.day}.json")
-                if os.path.exists(log_path):
-                    try:
-                        with open(log_path, 'r') as f:
-                            log_data = json.load(f)
-                            month_total += len(log_data)
-                    except (json.JSONDecodeError, FileNotFoundError):
-                        pass
-                current_day += datetime.timedelta(days=1)
+            elif period == 'monthly':
+                # Get data for the month containing the selected date
+                month_start = selected_date.replace(day=1)
+                month_total = sum(len(log_data) for log_data in scan_log_files(legacy_month_log_paths(month_start)))
             
-            if month_total > 0:
-                result["monthly"].append({
-                    "month_of": month_start.strftime("%Y-%m"),
-                    "total": month_total
-                })
+                if month_total > 0:
+                    result["monthly"].append({
+                        "month_of": month_start.strftime("%Y-%m"),
+                        "total": month_total
+                    })
         
         return jsonify({
             **result,
@@ -2216,7 +4455,7 @@ def passenger_details():
                 source = 'ingest'
         
         # Fallback to log files if ingest not available or no data
-        if not passengers:
+        if not passengers and log_fallback_needed():
             source = 'logs'
             # Parse the date
             if period == 'daily':
@@ -2224,8 +4463,7 @@ def passenger_details():
                 log_file = os.path.join(LOG_DIR, str(target_date.year), str(target_date.month), f"{target_date.day}.json")
                 
                 if os.path.exists(log_file):
-                    with open(log_file, 'r') as f:
-                        passengers = json.load(f)
+                    passengers = read_log_file(log_file)
                 else:
                     passengers = []
                     
@@ -2239,23 +4477,16 @@ def passenger_details():
                     day = start_of_week + datetime.timedelta(days=i)
                     log_file = os.path.join(LOG_DIR, str(day.year), str(day.month), f"{day.day}.json")
                     if os.path.exists(log_file):
-                        with open(log_file, 'r') as f:
-                            day_passengers = json.load(f)
-                            passengers.extend(day_passengers)
-                            
+                        day_passengers = read_log_file(log_file)
+                        passengers.extend(day_passengers)
+                        
             elif period == 'monthly':
                 # For monthly, get all days in that month
                 target_date = datetime.datetime.strptime(date, '%Y-%m')
-                month_dir = os.path.join(LOG_DIR, str(target_date.year), str(target_date.month))
                 passengers = []
                 
-                if os.path.exists(month_dir):
-                    for day_file in os.listdir(month_dir):
-                        if day_file.endswith('.json'):
-                            day_path = os.path.join(month_dir, day_file)
-                            with open(day_path, 'r') as f:
-                                day_passengers = json.load(f)
-                                passengers.extend(day_passengers)
+                for day_passengers in scan_log_files(manifest_log_files(target_date.year, target_date.month)):
+                    passengers.extend(day_passengers)
         
         return jsonify({
             'passengers': passengers,
@@ -2285,40 +4516,47 @@ def upload_data():
         etrike_id = request.form.get('etrike_id', 'unknown')
         
         print(f"📦 Received data from Pi: {pi_id} ({city}, {toda_id}, {etrike_id})")
+        gps_store.set_labels(pi_id, city=city, toda_id=toda_id, etrike_id=etrike_id)
         print(f"📦 File size: {file.content_length} bytes")
         print(f"📦 File name: {file.filename}")
         
         if file and file.filename.endswith('.zip'):
-            # Save the uploaded zip file temporarily
             import tempfile
             import zipfile
             
-            with tempfile.NamedTemporaryFile(suffix='.zip', delete=False) as temp_file:
-                file.save(temp_file.name)
-                
-                # Extract and merge data instead of overwriting
-                with zipfile.ZipFile(temp_file.name, 'r') as zip_ref:
-                    json_files = [f for f in zip_ref.filelist if f.filename.endswith('.json')]
-                    print(f"📦 Found {len(json_files)} JSON files in zip")
-                    
-                    for file_info in json_files:
-                        print(f"📦 Processing: {file_info.filename}")
-                        # Extract to temporary location first
-                        temp_data = zip_ref.read(file_info.filename)
-                        
-                        # Parse the JSON data
-                        new_data = json.loads(temp_data.decode('utf-8'))
-                        print(f"📦 File {file_info.filename} contains {len(new_data) if isinstance(new_data, list) else 1} entries")
-                        
-                        # Save data separately by device
-                        save_log_data_by_device(file_info.filename, new_data, pi_id)
+            # Werkzeug already spools large uploads to disk; only copy streams zipfile cannot seek
+            package = file.stream
+            if not package.seekable():
+                package = tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_MAX_BYTES)
+                shutil.copyfileobj(file.stream, package)
+                package.seek(0)
+            
+            # Entries grouped by destination device file, appended once per file
+            pending = defaultdict(list)
+            buffered = 0
+            with zipfile.ZipFile(package, 'r') as zip_ref:
+                json_files = [f for f in zip_ref.infolist() if f.filename.endswith('.json')]
+                print(f"📦 Found {len(json_files)} JSON files in zip")
                 
-                # Clean up temp file
-                os.remove(temp_file.name)
+                for file_info in json_files:
+                    count = 0
+                    with zip_ref.open(file_info) as member:
+                        for entry in iter_json_records(member):
+                            pending[file_info.filename].append(entry)
+                            count += 1
+                            buffered += 1
+                            # Bound memory on large backlogs
+                            if buffered >= UPLOAD_BUFFER_ENTRIES:
+                                _flush_upload_entries(pending, pi_id)
+                                buffered = 0
+                    print(f"📦 File {file_info.filename} contains {count} entries")
+            _flush_upload_entries(pending, pi_id)
             
-            # Update the last Pi heartbeat time
-            global last_pi_heartbeat_time
-            last_pi_heartbeat_time = datetime.datetime.now().timestamp()
+            bump_data_version()
+            schedule_dashboard_push()
+            
+            # Update the Pi's heartbeat
+            pi_heartbeats.touch(pi_id)
             
             print(f"✅ Data package received and extracted")
             return jsonify({'message': 'Data uploaded successfully'}), 200
@@ -2329,6 +4567,13 @@ def upload_data():
         print(f"❌ Upload error: {e}")
         return jsonify({'error': str(e)}), 500
 
+def _flush_upload_entries(pending, pi_id):
+    """Append the buffered upload entries, one bulk append per destination file"""
+    for filename, entries in pending.items():
+        if entries:
+            save_log_data_by_device(filename, entries, pi_id)
+    pending.clear()
+
 def save_log_data_by_device(filename, new_data, pi_id):
     """Save log data separately by Pi device to prevent data collision"""
     # Create device-specific filename
@@ -2337,59 +4582,14 @@ def save_log_data_by_device(filename, new_data, pi_id):
     base_name = filename.replace('.json', '')
     device_filename = f"{base_name}_{pi_id}.json"
     
-    # Load existing data for this device if it exists
-    existing_data = []
-    if os.path.exists(device_filename):
-        try:
-            with open(device_filename, 'r') as f:
-                existing_data = json.load(f)
-        except (json.JSONDecodeError, FileNotFoundError):
-            existing_data = []
-    
-    # Handle different data types
-    # If existing data is a dict, convert to list
-    if isinstance(existing_data, dict):
-        existing_data = [existing_data]
-    
     # If new data is a dict, convert to list
     if isinstance(new_data, dict):
         new_data = [new_data]
-    
-    # Ensure both are lists before extending
-    if not isinstance(existing_data, list):
-        existing_data = []
     if not isinstance(new_data, list):
         new_data = []
     
-    # Create a set of existing entry signatures to detect duplicates
-    existing_signatures = set()
-    for entry in existing_data:
-        # Create a unique signature based on person_id, entry_timestamp, and pi_id
-        signature = f"{entry.get('person_id')}_{entry.get('entry_timestamp')}_{entry.get('pi_id')}"
-        existing_signatures.add(signature)
-    
-    # Only add new entries that don't already exist
-    duplicates_skipped = 0
-    new_entries_added = 0
-    for entry in new_data:
-        signature = f"{entry.get('person_id')}_{entry.get('entry_timestamp')}_{entry.get('pi_id')}"
-        if signature not in existing_signatures:
-            existing_data.append(entry)
-            existing_signatures.add(signature)
-            new_entries_added += 1
-        else:
-            duplicates_skipped += 1
-    
-    # Only save if there were new entries added
-    if new_entries_added > 0:
-        # Save device-specific data
-        # Only create directory if filename has a directory path
-        dir_path = os.path.dirname(device_filename)
-        if dir_path:  # Only create directory if there's a path
-            os.makedirs(dir_path, exist_ok=True)
-        
-        with open(device_filename, 'w') as f:
-            json.dump(existing_data, f, indent=4)
+    # Append only entries whose signature (person_id, entry_timestamp, pi_id) is not in the file yet
+    new_entries_added, duplicates_skipped = append_log_entries(device_filename, new_data)
     
     print(f"📊 Pi {pi_id}: {new_entries_added} new entries added, {duplicates_skipped} duplicates skipped in {device_filename}")
     
@@ -2397,65 +4597,211 @@ def save_log_data_by_device(filename, new_data, pi_id):
     if duplicates_skipped > 0 and new_entries_added == 0:
         print(f"⚠️  WARNING: Pi {pi_id} sent {duplicates_skipped} duplicate entries - no new data added")
 
-def cleanup_duplicate_data():
-    """Clean up existing duplicate data in log files"""
-    print("🧹 Starting duplicate cleanup...")
-    
-    # Get all log files
-    log_files = []
-    if os.path.exists(LOG_DIR):
-        for year in os.listdir(LOG_DIR):
-            year_path = os.path.join(LOG_DIR, year)
-            if os.path.isdir(year_path):
-                for month in os.listdir(year_path):
-                    month_path = os.path.join(year_path, month)
-                    if os.path.isdir(month_path):
-                        for day_file in os.listdir(month_path):
-                            if day_file.endswith('.json'):
-                                log_files.append(os.path.join(month_path, day_file))
-    
-    total_duplicates_removed = 0
-    for log_file in log_files:
-        try:
-            with open(log_file, 'r') as f:
-                data = json.load(f)
-            
-            if not isinstance(data, list):
+CLEANUP_WORKERS = int(os.getenv("CLEANUP_WORKERS", "4"))  # files deduplicated in parallel
+_cleanup_executor = concurrent.futures.ThreadPoolExecutor(max_workers=CLEANUP_WORKERS, thread_name_prefix="cleanup")
+_cleanup_job_lock = threading.Lock()
+
+def _pending_cleanup_files():
+    """Log files (relative paths) whose size/mtime differ from what the last cleanup left"""
+    conn = _log_manifest_conn()
+    try:
+        cleaned = {row[0]: (row[1], row[2]) for row in conn.execute("SELECT path, size, mtime_ns FROM log_cleanup_state")}
+        log_files = []
+        for (path,) in conn.execute("SELECT path FROM log_files ORDER BY path").fetchall():
+            try:
+                st = os.stat(os.path.join(LOG_DIR, path))
+            except FileNotFoundError:
                 continue
+            if cleaned.get(path) != (st.st_size, st.st_mtime_ns):
+                log_files.append(path)
+        return log_files
+    finally:
+        conn.close()
+
+def _cleanup_log_file(rel):
+    """Remove duplicate signatures from one log file.
+
+    Entries that are not records (stray lists, strings, nulls) are kept as-is
+    and counted rather than failing the file. Returns (removed, malformed).
+    """
+    log_file = os.path.join(LOG_DIR, rel)
+    try:
+        with log_path_lock(log_file):
+            data = read_log_file(log_file)
             
             # Remove duplicates based on signature
             seen_signatures = set()
             unique_data = []
             duplicates_in_file = 0
+            malformed = 0
             
             for entry in data:
-                signature = f"{entry.get('person_id')}_{entry.get('entry_timestamp')}_{entry.get('pi_id')}"
+                if not isinstance(entry, dict):
+                    unique_data.append(entry)
+                    malformed += 1
+                    continue
+                signature = _log_entry_key(entry, 'signature')
                 if signature not in seen_signatures:
                     unique_data.append(entry)
                     seen_signatures.add(signature)
                 else:
                     duplicates_in_file += 1
             
-            if duplicates_in_file > 0:
-                # Save cleaned data
-                with open(log_file, 'w') as f:
-                    json.dump(unique_data, f, indent=4)
-                
-                total_duplicates_removed += duplicates_in_file
-                print(f"🧹 Cleaned {log_file}: removed {duplicates_in_file} duplicates")
-        
-        except (json.JSONDecodeError, FileNotFoundError):
-            continue
+            conn = _log_manifest_conn()
+            try:
+                if duplicates_in_file > 0:
+                    # Save cleaned data (temp file + rename)
+                    write_log_file(log_file, unique_data)
+                    _drop_signature_index(conn, log_file)
+                st = os.stat(log_file)
+                # Checkpoint: this file is clean as of its current size/mtime
+                conn.execute("INSERT OR REPLACE INTO log_cleanup_state VALUES (?, ?, ?)",
+                             (rel, st.st_size, st.st_mtime_ns))
+                conn.commit()
+            finally:
+                conn.close()
+    except (json.JSONDecodeError, FileNotFoundError):
+        return 0, 0
     
-    print(f"✅ Cleanup complete: removed {total_duplicates_removed} total duplicates")
+    if malformed:
+        print(f"⚠️ {log_file}: skipped {malformed} malformed entries")
+    if duplicates_in_file > 0:
+        update_log_manifest(log_file, unique_data)
+        print(f"🧹 Cleaned {log_file}: removed {duplicates_in_file} duplicates")
+    return duplicates_in_file, malformed
+
+def _update_cleanup_job(job_id, **fields):
+    """Persist a cleanup job's progress"""
+    conn = _log_manifest_conn()
+    try:
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        conn.execute(f"UPDATE cleanup_jobs SET {assignments} WHERE job_id = ?", list(fields.values()) + [job_id])
+        conn.commit()
+    finally:
+        conn.close()
+
+def run_cleanup_job(job_id):
+    """Deduplicate every changed log file on the cleanup pool, recording progress on the job"""
+    print(f"🧹 Starting duplicate cleanup job {job_id}...")
+    try:
+        conn = _log_manifest_conn()
+        try:
+            row = conn.execute("SELECT files_done, duplicates_removed, malformed_entries FROM cleanup_jobs WHERE job_id = ?",
+                               (job_id,)).fetchone()
+        finally:
+            conn.close()
+        # A resumed job keeps the counts of the files it already finished
+        files_done, total_duplicates_removed, total_malformed = row if row else (0, 0, 0)
+        
+        log_files = _pending_cleanup_files()
+        print(f"🧹 {len(log_files)} log files changed since the last cleanup")
+        _update_cleanup_job(job_id, state='running', files_total=files_done + len(log_files),
+                            started_at=time.time())
+        
+        futures = [_cleanup_executor.submit(_cleanup_log_file, rel) for rel in log_files]
+        for i, future in enumerate(concurrent.futures.as_completed(futures), 1):
+            removed, malformed = future.result()
+            total_duplicates_removed += removed
+            total_malformed += malformed
+            # Checkpoint every file so a resumed job reports accurate counts
+            _update_cleanup_job(job_id, files_done=files_done + i, duplicates_removed=total_duplicates_removed,
+                                malformed_entries=total_malformed)
+        
+        _update_cleanup_job(job_id, state='done', finished_at=time.time())
+        if total_duplicates_removed:
+            # Cached responses may still count the removed duplicates
+            bump_data_version()
+        schedule_dashboard_push()
+        print(f"✅ Cleanup complete: removed {total_duplicates_removed} total duplicates"
+              f" ({total_malformed} malformed entries skipped)")
+    except Exception as e:
+        print(f"❌ Cleanup job {job_id} failed: {e}")
+        bump_data_version()  # files finished before the failure were rewritten
+        _update_cleanup_job(job_id, state='failed', error=str(e), finished_at=time.time())
+
+def _create_cleanup_job():
+    """Record a new cleanup job unless one is unfinished; returns (job_id, created)"""
+    with _cleanup_job_lock:
+        conn = _log_manifest_conn()
+        try:
+            running = conn.execute("SELECT job_id FROM cleanup_jobs WHERE state IN ('queued', 'running')").fetchone()
+            if running:
+                return running[0], False
+            job_id = uuid.uuid4().hex[:12]
+            conn.execute("INSERT INTO cleanup_jobs (job_id, state, created_at) VALUES (?, 'queued', ?)",
+                         (job_id, time.time()))
+            conn.commit()
+        finally:
+            conn.close()
+    return job_id, True
+
+def start_cleanup_job():
+    """Create a cleanup job and run it in the background; returns (job_id, created)"""
+    job_id, created = _create_cleanup_job()
+    if created:
+        threading.Thread(target=run_cleanup_job, args=(job_id,), daemon=True).start()
+    return job_id, created
+
+def resume_cleanup_jobs():
+    """Restart a cleanup job interrupted by a restart; finished files are skipped"""
+    conn = _log_manifest_conn()
+    try:
+        rows = conn.execute("SELECT job_id FROM cleanup_jobs WHERE state IN ('queued', 'running')").fetchall()
+    finally:
+        conn.close()
+    for (job_id,) in rows:
+        print(f"🧹 Resuming cleanup job {job_id}")
+        threading.Thread(target=run_cleanup_job, args=(job_id,), daemon=True).start()
+
+def cleanup_duplicate_data():
+    """Clean up duplicate data in log files changed since the last cleanup, in the calling thread"""
+    job_id, created = _create_cleanup_job()
+    if created:
+        run_cleanup_job(job_id)
+    return job_id
 
 @app.route('/cleanup-duplicates', methods=['POST'])
 @login_required
 def cleanup_duplicates_route():
-    """Trigger duplicate cleanup"""
+    """Start a background duplicate cleanup job"""
+    try:
+        job_id, created = start_cleanup_job()
+        body = {'job_id': job_id, 'status_url': url_for('cleanup_job_status', job_id=job_id)}
+        if not created:
+            return jsonify({'error': 'A cleanup job is already running', **body}), 409
+        return jsonify({'message': 'Duplicate cleanup started', **body}), 202
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/cleanup-duplicates/<job_id>')
+@login_required
+def cleanup_job_status(job_id):
+    """Progress and throughput of a duplicate cleanup job"""
+    conn = _log_manifest_conn()
+    try:
+        conn.row_factory = sqlite3.Row
+        row = conn.execute("SELECT * FROM cleanup_jobs WHERE job_id = ?", (job_id,)).fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    
+    job = dict(row)
+    if job['started_at']:
+        elapsed = (job['finished_at'] or time.time()) - job['started_at']
+        job['elapsed_seconds'] = round(elapsed, 1)
+        job['files_per_second'] = round(job['files_done'] / elapsed, 1) if elapsed > 0 else None
+    return jsonify(job)
+
+@app.route('/reconcile-log-manifest', methods=['POST'])
+@login_required
+def reconcile_log_manifest_route():
+    """Re-index log files copied into or restored under LOG_DIR while running"""
     try:
-        cleanup_duplicate_data()
-        return jsonify({'message': 'Duplicate cleanup completed successfully'}), 200
+        indexed, removed = reconcile_log_manifest()
+        if indexed or removed:
+            bump_data_version()
+        return jsonify({'indexed': indexed, 'removed': removed})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -2491,11 +4837,10 @@ def export_pdf():
                     source = 'ingest'
             
             # Fallback to log files if ingest not available or no data
-            if not passengers:
+            if not passengers and log_fallback_needed():
                 log_file = os.path.join(LOG_DIR, str(target_date.year), str(target_date.month), f"{target_date.day}.json")
                 if os.path.exists(log_file):
-                    with open(log_file, 'r') as f:
-                        passengers = json.load(f)
+                    passengers = read_log_file(log_file)
                 source = 'logs'
                 
             title = f"Daily Report - {target_date.strftime('%B %d, %Y')}"
@@ -2531,15 +4876,14 @@ def export_pdf():
                     source = 'ingest'
             
             # Fallback to log files if ingest not available or no data
-            if not passengers:
+            if not passengers and log_fallback_needed():
                 passengers = []
                 for i in range(7):
                     day = start_of_week + datetime.timedelta(days=i)
                     log_file = os.path.join(LOG_DIR, str(day.year), str(day.month), f"{day.day}.json")
                     if os.path.exists(log_file):
-                        with open(log_file, 'r') as f:
-                            day_passengers = json.load(f)
-                            passengers.extend(day_passengers)
+                        day_passengers = read_log_file(log_file)
+                        passengers.extend(day_passengers)
                 source = 'logs'
             
             # Calculate end of week (6 days after start)
@@ -2557,16 +4901,10 @@ def export_pdf():
                     source = 'ingest'
             
             # Fallback to log files if ingest not available or no data
-            if not passengers:
-                month_dir = os.path.join(LOG_DIR, str(target_date.year), str(target_date.month))
+            if not passengers and log_fallback_needed():
                 passengers = []
-                if os.path.exists(month_dir):
-                    for day_file in os.listdir(month_dir):
-                        if day_file.endswith('.json'):
-                            day_path = os.path.join(month_dir, day_file)
-                            with open(day_path, 'r') as f:
-                                day_passengers = json.load(f)
-                                passengers.extend(day_passengers)
+                for day_passengers in scan_log_files(manifest_log_files(target_date.year, target_date.month)):
+                    passengers.extend(day_passengers)
                 source = 'logs'
             
             # Calculate first and last day of month
@@ -2846,33 +5184,10 @@ def save_event_to_logs(event, device_id):
         # Use device-specific filename
         log_file = os.path.join(log_dir, f"{entry_date.day}_{device_id}.json")
         
-        # Load existing data
-        existing_data = []
-        if os.path.exists(log_file):
-            try:
-                with open(log_file, 'r') as f:
-                    existing_data = json.load(f)
-            except (json.JSONDecodeError, FileNotFoundError):
-                existing_data = []
-        
-        # Ensure existing_data is a list
-        if not isinstance(existing_data, list):
-            existing_data = []
-        
-        # Check if event already exists (idempotent)
-        event_id = event.get('event_id')
-        if event_id:
-            # Check if event with this ID already exists
-            for existing_event in existing_data:
-                if existing_event.get('event_id') == event_id:
-                    return False  # Event already exists, skip
-        
-        # Add event to data
-        existing_data.append(event)
-        
-        # Save back to file
-        with open(log_file, 'w') as f:
-            json.dump(existing_data, f, indent=4)
+        # Append unless an event with this ID is already logged (idempotent)
+        added, _ = append_log_entries(log_file, [event], key_kind='event_id')
+        if not added:
+            return False  # Event already exists, skip
         
         return True  # Event was added
         
@@ -2880,11 +5195,226 @@ def save_event_to_logs(event, device_id):
         print(f"Error saving event to logs: {e}")
         return False
 
+# ============================================================================
+# LOG IMPORT - backfill the sessions table from the logs/ tree
+# ============================================================================
+
+# True once every log file in the manifest is in sessions; the empty-result log
+# fallbacks are skipped from then on
+_logs_imported = False
+_log_import_lock = threading.Lock()
+_log_import_status = {'state': 'idle'}
+
+def log_fallback_needed():
+    """Whether a route that found nothing in sessions should still scan the logs"""
+    return not (USE_INGEST and _logs_imported)
+
+def _log_file_sessions(entries, device_id=None):
+    """Sessions for the entries of one log file.
+
+    session_id is the person_id_entry_timestamp signature, so the sessions
+    upsert merges entries already imported or ingested instead of duplicating them.
+    """
+    sessions = []
+    for entry in entries:
+        if isinstance(entry, dict):
+            s = _extract_session_from_payload(entry, entry.get('pi_id') or device_id or 'logs')
+            if s:
+                sessions.append(s)
+    return sessions
+
+_CHECKPOINT_UPSERT_SQL = "INSERT OR REPLACE INTO log_import_checkpoints VALUES (?, ?, ?, ?, ?)"
+
+def _import_write(sessions, checkpoints, notify):
+    """Queued write for an import batch: sessions, their sketches and the files' checkpoints.
+
+    Sketches and counters see the stored (merged) rows. With notify the rows also
+    go to _after_ingest_commit; the bulk import re-warms counters once at the end.
+    The future resolves to the merged rows.
+    """
+    def write(conn):
+        _upsert_sessions(conn, sessions)
+        merged = _merged_sessions(conn, sessions)
+        _update_passenger_sketches(conn, merged)
+        conn.executemany(_CHECKPOINT_UPSERT_SQL, checkpoints)
+        if notify:
+            return len(merged), merged, merged
+        return 0, [], merged
+    return write
+
+def _commit_import_batch(sessions, checkpoints, notify=False):
+    """Commit an import batch through the ingest writer, blocking until it is durable.
+
+    The bulk import waits for queue room; an upload's append (notify) raises
+    queue.Full instead and leaves the file to the next bulk import.
+    """
+    write = _import_write(sessions, checkpoints, notify)
+    return _submit_write(write, len(sessions), block=not notify).result()
+
+def _import_appended_log_entries(path, entries, st):
+    """Keep sessions in step with a log append so the import stays complete"""
+    global _logs_imported
+    rel = os.path.relpath(path, LOG_DIR)
+    try:
+        sessions = _log_file_sessions(entries, (_parse_log_path(path) or (None,) * 5)[4])
+        _commit_import_batch(sessions, [(rel, st.st_size, st.st_mtime_ns, len(sessions), time.time())],
+                             notify=True)
+    except Exception as e:
+        # The bulk importer picks the file up on its next run
+        _logs_imported = False
+        print(f"[IMPORT] Could not import appended entries of {path}: {e}")
+
+def _pending_log_imports(conn):
+    """Manifest rows whose file changed since it was last imported"""
+    mconn = _log_manifest_conn()
+    try:
+        files = mconn.execute("SELECT path, device_id, size, mtime_ns FROM log_files ORDER BY year, month, day, path").fetchall()
+    finally:
+        mconn.close()
+    done = {row[0]: (row[1], row[2]) for row in conn.execute("SELECT path, size, mtime_ns FROM log_import_checkpoints")}
+    return [f for f in files if done.get(f[0]) != (f[2], f[3])]
+
+def refresh_logs_imported():
+    """Recompute whether sessions hold every log file"""
+    global _logs_imported
+    conn = _events_db_conn()
+    try:
+        _logs_imported = not _pending_log_imports(conn)
+    finally:
+        conn.close()
+    return _logs_imported
+
+def import_logs_to_sessions(batch_sessions=None):
+    """
+    Stream every day/device log file into sessions (python dashboard.py --import-logs).
+    Each transaction also records the imported files' size and mtime, so an
+    interrupted run resumes where it stopped and re-runs skip unchanged files.
+    """
+    try:
+        return _run_log_import(batch_sessions)
+    except Exception as e:
+        # Committed batches are checkpointed, so a retry resumes after them
+        print(f"[IMPORT] Import failed: {e}")
+        _log_import_status.update({'state': 'failed', 'error': str(e), 'finished_at': time.time()})
+        return dict(_log_import_status)
+
+def _run_log_import(batch_sessions):
+    """Body of import_logs_to_sessions; raises on database or disk errors"""
+    global _logs_imported
+    batch_sessions = batch_sessions or LOG_IMPORT_BATCH_SESSIONS
+    with _log_import_lock:
+        conn = _events_db_conn()
+        try:
+            pending = _pending_log_imports(conn)
+            total = len(pending)
+            started = time.time()
+            _log_import_status.update({'state': 'running', 'files_total': total, 'files_done': 0,
+                                       'sessions': 0, 'errors': 0, 'started_at': started, 'error': None})
+            print(f"[IMPORT] {total} log files to import")
+            
+            batch, checkpoints = [], []
+            files_done = imported = errors = 0
+            for rel, device_id, _, _ in pending:
+                path = os.path.join(LOG_DIR, rel)
+                try:
+                    # Stat before reading: a file appended meanwhile is simply imported again next run
+                    st = os.stat(path)
+                    sessions = _log_file_sessions(read_log_file(path), device_id)
+                except (json.JSONDecodeError, OSError) as e:
+                    errors += 1
+                    print(f"[IMPORT] Skipping {path}: {e}")
+                    continue
+                batch.extend(sessions)
+                checkpoints.append((rel, st.st_size, st.st_mtime_ns, len(sessions), time.time()))
+                files_done += 1
+                
+                if len(batch) >= batch_sessions:
+                    _commit_import_batch(batch, checkpoints)
+                    imported += len(batch)
+                    batch, checkpoints = [], []
+                    _log_import_status.update({'files_done': files_done, 'sessions': imported, 'errors': errors})
+                    rate = imported / max(time.time() - started, 0.001)
+                    print(f"[IMPORT] {files_done}/{total} files, {imported} sessions ({rate:.0f}/s)")
+            if checkpoints:
+                _commit_import_batch(batch, checkpoints)
+                imported += len(batch)
+            
+            live_counters.warm(conn)
+        finally:
+            conn.close()
+    
+    bump_data_version()
+    schedule_dashboard_push()
+    _logs_imported = errors == 0 and refresh_logs_imported()
+    _log_import_status.update({'state': 'done', 'files_done': files_done, 'sessions': imported,
+                               'errors': errors, 'finished_at': time.time()})
+    print(f"[IMPORT] Imported {imported} sessions from {files_done} files ({errors} errors)")
+    return dict(_log_import_status)
+
+@app.route('/import-logs', methods=['GET', 'POST'])
+@login_required
+def import_logs_route():
+    """Start a log backfill into sessions (POST) or report its progress (GET)"""
+    if not USE_INGEST:
+        return jsonify({'error': 'Ingest database is disabled (USE_INGEST=false)'}), 400
+    if request.method == 'GET':
+        return jsonify({**_log_import_status, 'complete': _logs_imported})
+    if _log_import_status.get('state') == 'running':
+        return jsonify({'error': 'Import already running', **_log_import_status}), 409
+    _log_import_status.update({'state': 'running'})
+    threading.Thread(target=import_logs_to_sessions, daemon=True).start()
+    return jsonify({'message': 'Import started'}), 202
+
+# Pick up log files that changed on disk while the app was down
+try:
+    reconcile_log_manifest()
+except Exception as e:
+    print(f"[MANIFEST] Could not reconcile log manifest: {e}")
+
+# Create the events schema once at startup so requests never run DDL
+if USE_INGEST:
+    try:
+        init_events_db()
+        conn = _events_db_conn()
+        live_counters.warm(conn)
+        conn.close()
+        print(f"[INGEST] Live counters warmed: {live_counters.counts()}")
+        if refresh_logs_imported():
+            print("[IMPORT] All log files are in sessions; empty-result log fallbacks disabled")
+    except Exception as e:
+        print(f"[INGEST] Could not initialise events database: {e}")
+
+# Restore the last GPS positions and keep snapshotting them
+try:
+    restored = gps_store.load(GPS_SNAPSHOT_PATH)
+    if restored:
+        print(f"📍 Restored GPS positions for {restored} devices")
+except Exception as e:
+    print(f"Could not restore GPS snapshot: {e}")
+threading.Thread(target=_gps_snapshot_loop, daemon=True).start()
+atexit.register(gps_store.save, GPS_SNAPSHOT_PATH)
+atexit.register(flush_track_writer)
+
+# Pick up a duplicate cleanup job that a restart interrupted
+try:
+    resume_cleanup_jobs()
+except Exception as e:
+    print(f"Could not resume cleanup jobs: {e}")
 
 if __name__ == '__main__':
     import ssl
     import os
     
+    if '--rebuild-log-manifest' in sys.argv:
+        rebuild_log_manifest()
+        sys.exit(0)
+    if '--convert-logs-ndjson' in sys.argv:
+        convert_logs_to_ndjson()
+        sys.exit(0)
+    if '--import-logs' in sys.argv:
+        status = import_logs_to_sessions()
+        sys.exit(0 if status.get('state') == 'done' else 1)
+    
     # Check if SSL certificates exist
     cert_path = '/etc/letsencrypt/live/etrikedashboard.com/fullchain.pem'
     key_path = '/etc/letsencrypt/live/etrikedashboard.com/privkey.pem'
@@ -0,0 +1,54 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# dashboard keeps its logs and databases relative to the working directory
+_cwd = os.getcwd()
+os.chdir(tempfile.mkdtemp())
+try:
+    import dashboard
+finally:
+    os.chdir(_cwd)
+
+
+def _no_logs(*args, **kwargs):
+    raise AssertionError("log files were read although ingest had rows")
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    # A log file for every day of September 2025, so any fallback scan finds something
+    os.makedirs(tmp_path / '2025' / '9')
+    for day in range(1, 31):
+        (tmp_path / '2025' / '9' / f'{day}.json').write_text('[{"person_id": 1}]')
+    monkeypatch.setattr(dashboard, 'LOG_DIR', str(tmp_path))
+    monkeypatch.setattr(dashboard, 'USE_INGEST', True)
+    monkeypatch.setattr(dashboard, 'read_log_file', _no_logs)
+    monkeypatch.setattr(dashboard, 'scan_log_files', _no_logs)
+    monkeypatch.setattr(dashboard, 'log_fallback_needed', lambda: True)
+    dashboard.app.config['TESTING'] = True
+    with dashboard.app.test_client() as client:
+        with client.session_transaction() as sess:
+            sess['logged_in'] = True
+        yield client
+
+
+@pytest.mark.parametrize('period, date, row', [
+    ('weekly', '2025-09-26', {'week_of': '2025-09-22', 'total': 7}),
+    ('monthly', '2025-09', {'month_of': '2025-09', 'total': 30}),
+])
+def test_ingest_rows_skip_log_fallback(client, monkeypatch, period, date, row):
+    ingest = {'daily': [], 'weekly': [], 'monthly': []}
+    ingest[period] = [row]
+    monkeypatch.setattr(dashboard, 'get_historical_data_filtered_from_ingest', lambda d, p: ingest)
+
+    response = client.get(f'/historical-data-filtered?date={date}&period={period}')
+
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['source'] == 'ingest'
+    assert body[period] == [row]